@@ -0,0 +1,329 @@
+"""
+    Benchmarks of simulation, graph generation and evaluation
+
+    Every case runs with fixed seeds and reports seconds per call.
+    Results are written as JSON, so that runs of different commits
+    can be compared:
+
+        python benchmark.py --output before.json
+        python benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+import kernels
+import random_graph
+import simulation
+from eval_pregenerated import Evaluate_pregenerated
+from generate_graph import GraphGenerator, GraphState, Make_directed
+from generation_stats import GenerationStats
+from graph_library import pack_directory
+
+E = 100000
+GAMMA = 0.05
+THETA = 0.2
+
+
+def measure(results, name, params, fn, min_time = 0.2, max_runs = 50, per_unit = False):
+    """Times fn and appends the result
+
+    fn is called until min_time seconds are spent or max_runs calls are made.
+
+    Parameters
+    ----------
+    results : array
+        Array the result is appended to.
+    name : string
+        Name of benchmark.
+    params : dict
+        Parameters of the case.
+    fn : function
+        Function without arguments, called for every run.
+    min_time : float
+        Seconds to spend on the case.
+    max_runs : int
+        Maximum number of calls.
+    per_unit : Boolean
+        Whether fn returns number of units it processed, such as
+        iterations or graphs, and seconds are reported per unit.
+
+    """
+    times = []
+    spent = 0
+    while len(times) < max_runs and (len(times) == 0 or spent < min_time):
+        start = time.perf_counter()
+        units = fn()
+        seconds = time.perf_counter() - start
+        spent += seconds
+        times.append(seconds / units if per_unit else seconds)
+
+    result = {
+        'name': name,
+        'params': params,
+        'seconds': float(np.median(times)),
+        'min': float(np.min(times)),
+        'runs': len(times),
+    }
+    results.append(result)
+    print("%-28s %-48s %12.6f s (%i runs)" % (name, json.dumps(params, sort_keys=True), result['seconds'], result['runs']))
+
+
+def cases(sizes, densities, max_edges, degrees = ()):
+    """(N, p) pairs with at most max_edges expected edges
+
+    Parameters
+    ----------
+    sizes : array
+        Numbers of banks.
+    densities : array
+        Erdös-Rényi probabilities used for every size.
+    max_edges : float
+        Largest number of expected edges.
+    degrees : array
+        Expected degrees, p is scaled with N so that large sizes
+        also get sparse cases.
+
+    """
+    pairs = []
+    for N in sizes:
+        ps = list(densities) + [min(1.0, d / max(N - 1, 1)) for d in degrees]
+        for p in ps:
+            if N * (N - 1) * p <= max_edges and (N, p) not in pairs:
+                pairs.append((N, p))
+    return pairs
+
+
+def graph_order(g, _):
+    """Cheap evalParam for Evaluate_pregenerated benchmarks"""
+    return g.vcount()
+
+
+def bench_random_graph(results, sizes, densities, max_edges, min_time, degrees = ()):
+    for N, p in cases(sizes, densities, max_edges, degrees):
+        for fn in [random_graph.Directed, random_graph.Directed2, random_graph.Undirected]:
+            measure(results, "random_graph." + fn.__name__, {'N': N, 'p': p},
+                    lambda: fn(N, p, 0), min_time)
+
+
+def bench_simulation(results, sizes, densities, max_edges, min_time, degrees = ()):
+    for N, p in cases(sizes, densities, max_edges, degrees):
+        params = {'N': N, 'p': p}
+        g = random_graph.Directed2(N, p, 0)
+        dense = N <= 2500
+
+        if dense:
+            measure(results, "apply", params, lambda: simulation.apply(g, E, GAMMA, THETA), min_time)
+        if simulation.scipy is not None:
+            measure(results, "apply.sparse", params, lambda: simulation.apply(g, E, GAMMA, THETA, True), min_time)
+
+        if dense:
+            weights = simulation.apply(g, E, GAMMA, THETA)
+            measure(results, "simulate", params, lambda: simulation.simulate(g, weights, E, 0), min_time)
+            measure(results, "simulate_all", params, lambda: simulation.simulate_all(g, weights, E), min_time)
+        if simulation.scipy is not None:
+            weights = simulation.apply(g, E, GAMMA, THETA, True)
+            measure(results, "simulate_frontier.sparse", params, lambda: simulation.simulate_frontier(g, weights, E, 0), min_time)
+
+        if dense:
+            measure(results, "sim_defaults", params, lambda: simulation.sim_defaults(E, N, p, THETA, GAMMA, E, seed = 0), min_time)
+
+
+def bench_make_directed(results, sizes, densities, max_edges, min_time, degrees = ()):
+    for N, p in cases([N for N in sizes if N <= 2500], densities, max_edges / 2, degrees):
+        g = random_graph.Undirected(N, p, 0)
+        rng = random.Random(0)
+        measure(results, "Make_directed", {'N': N, 'p': p}, lambda: Make_directed(g, rng), min_time)
+
+
+def bench_generation(results, sizes, densities, max_edges, min_time, degrees = ()):
+    target_sets = {
+        'clustering': lambda p: [('components', 1, 1), ('density', p, 1), ('clustering', 0.5, 1)],
+        'communities': lambda p: [('components', 1, 1), ('density', p, 1), ('modularity', (3, 0.85), 1), ('communities', 3, 1)],
+    }
+    for N, p in cases([N for N in sizes if N <= 250], densities, max_edges):
+        for name, make_targets in target_sets.items():
+            params = {'N': N, 'p': p, 'targets': name}
+            random.seed(0)
+            g = random_graph.Undirected(N, p, 0)
+
+            generator = GraphGenerator(make_targets(p), verbose = False, cache_size = 0)
+            state = GraphState(g.copy())
+
+            def mutate():
+                # rejected candidate, graph stays the same between runs
+                generator.mutate(state.graph, count = 3, state = state)
+                state.rollback()
+
+            measure(results, "GraphGenerator.mutate", params, mutate, min_time)
+            measure(results, "GraphGenerator.graph_energy", params,
+                    lambda: generator.graph_energy(state.graph, state), min_time)
+
+            iterations = 200
+            generator = GraphGenerator(make_targets(p), verbose = False)
+
+            def anneal():
+                random.seed(0)
+                generator.energy_cache.clear()
+                stats = GenerationStats()
+                generator.simulated_annealing(g, max_iter = iterations, stats = stats)
+                # chain may stop early
+                return stats.iterations
+
+            measure(results, "simulated_annealing.iter", params, anneal, min_time, 5, per_unit = True)
+
+
+def bench_evaluation(results, sizes, densities, max_edges, min_time, degrees = ()):
+    count = 40
+    for N, p in cases([N for N in sizes if N <= 250], densities[-1:], max_edges):
+        base = tempfile.mkdtemp()
+        try:
+            path = os.path.join(base, "graphs", "set_0")
+            os.makedirs(path)
+            for k in range(count):
+                random_graph.Undirected(N, p, k).write_pickle(os.path.join(path, "%i.graph" % k))
+
+            def evaluate():
+                Evaluate_pregenerated(os.path.join(base, "graphs"), graph_order, (E, GAMMA, THETA, E), seed = 0)
+                return count
+
+            measure(results, "Evaluate_pregenerated.graph", {'N': N, 'p': p, 'format': 'pickle'}, evaluate, min_time, 3, per_unit = True)
+
+            pack_directory(path)
+            measure(results, "Evaluate_pregenerated.graph", {'N': N, 'p': p, 'format': 'library'}, evaluate, min_time, 3, per_unit = True)
+        finally:
+            shutil.rmtree(base)
+
+
+def warm_up():
+    """Compiles kernels before timing, see kernels"""
+    g = random_graph.Directed2(10, 0.5, 0)
+    weights = simulation.apply(g, E, GAMMA, THETA)
+    simulation.simulate(g, weights, E, 0)
+    simulation.simulate_all(g, weights, E)
+    Make_directed(random_graph.Undirected(10, 0.5, 0))
+
+
+BENCHMARKS = {
+    'random_graph': bench_random_graph,
+    'simulation': bench_simulation,
+    'directed': bench_make_directed,
+    'generation': bench_generation,
+    'evaluation': bench_evaluation,
+}
+
+
+def metadata():
+    """Environment of a benchmark run"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'backend': kernels.backend,
+    }
+
+
+def compare(results, baseline, threshold = 0.1):
+    """Prints ratio of seconds to a previous run
+
+    Parameters
+    ----------
+    results : array
+        Results of this run.
+    baseline : dict
+        Output of a previous run.
+    threshold : float
+        Relative slowdown reported as regression.
+
+    Returns
+    -------
+    int
+        Number of regressions.
+
+    """
+    def key(result):
+        return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+    before = {key(r): r for r in baseline['results']}
+    regressions = 0
+    print("\nCompared to %s" % (baseline['meta'].get('commit') or "baseline"))
+    for result in results:
+        if key(result) not in before:
+            continue
+        ratio = result['seconds'] / max(before[key(result)]['seconds'], 1e-12)
+        if ratio > 1 + threshold:
+            mark = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 / (1 + threshold):
+            mark = "faster"
+        else:
+            mark = ""
+        print("%-28s %-48s %8.2fx %s" % (result['name'], json.dumps(result['params'], sort_keys=True), ratio, mark))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark simulation, generation and evaluation')
+
+    parser.add_argument('--sizes', dest='sizes', type=int, nargs='+', default=[25, 250, 2500, 25000],
+                        help='Numbers of banks')
+
+    parser.add_argument('--densities', dest='densities', type=float, nargs='+', default=[0.01, 0.05, 0.2],
+                        help='Erdös-Rényi probabilities')
+
+    parser.add_argument('--degrees', dest='degrees', type=float, nargs='*', default=[10],
+                        help='Expected degrees of sparse cases, p scaled with number of banks')
+
+    parser.add_argument('--max-edges', dest='maxEdges', type=float, default=2e6,
+                        help='Skip cases with more expected edges')
+
+    parser.add_argument('--only', dest='only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='Benchmark groups to run')
+
+    parser.add_argument('--min-time', dest='minTime', type=float, default=0.2,
+                        help='Seconds spent on each case')
+
+    parser.add_argument('--output', dest='output', default=None,
+                        help='JSON file for results')
+
+    parser.add_argument('--compare', dest='compare', default=None,
+                        help='JSON file of a previous run to compare with')
+
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.1,
+                        help='Relative slowdown reported as regression')
+
+    args = parser.parse_args()
+
+    warm_up()
+    results = []
+    for name in args.only:
+        BENCHMARKS[name](results, args.sizes, args.densities, args.maxEdges, args.minTime, args.degrees)
+
+    output = {'meta': metadata(), 'results': results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions > 0:
+            print("%i regressions" % regressions)
+            sys.exit(1)
@@ -0,0 +1,209 @@
+"""
+    Cooling schedules and stopping criteria for simulated annealing
+"""
+import time
+
+
+class HyperbolicCooling():
+    """Fixed schedule T0 / (1 + r * t), default of simulated annealing
+
+    Parameters
+    ----------
+    T0 : float
+        Initial temperature.
+    r : float
+        Cooling rate.
+
+    """
+    def __init__(self, T0 = 0.03, r = 0.001):
+        self.T0 = T0
+        self.r = r
+
+    def start(self, max_iter):
+        """Prepares schedule for a new run
+
+        Parameters
+        ----------
+        max_iter : int
+            Maximum amount of iterations of the run.
+
+        Returns
+        -------
+        float
+            Initial temperature.
+
+        """
+        return self.T0
+
+    def update(self, t, accepted, improved):
+        """Temperature for next iteration
+
+        Parameters
+        ----------
+        t : int
+            Iteration that has just finished.
+        accepted : Boolean
+            Whether candidate of this iteration was accepted.
+        improved : Boolean
+            Whether candidate of this iteration has the lowest energy so far.
+
+        Returns
+        -------
+        float
+            Temperature for next iteration.
+
+        """
+        return self.T0 / (1 + self.r * t)
+
+
+class AcceptanceRateCooling(HyperbolicCooling):
+    """Adaptive schedule that adjusts temperature after every window
+       of iterations so that acceptance rate follows a target that
+       decreases linearly from start_rate to end_rate during the run
+
+    Parameters
+    ----------
+    T0 : float
+        Initial temperature.
+    start_rate : float
+        Target acceptance rate at the start of the run.
+    end_rate : float
+        Target acceptance rate at the end of the run.
+    window : int
+        Number of iterations between adjustments.
+    factor : float
+        Multiplicative temperature adjustment.
+
+    """
+    def __init__(self, T0 = 0.03, start_rate = 0.5, end_rate = 0.01, window = 500, factor = 1.2):
+        self.T0 = T0
+        self.start_rate = start_rate
+        self.end_rate = end_rate
+        self.window = window
+        self.factor = factor
+
+    def start(self, max_iter):
+        self.max_iter = max(max_iter, 1)
+        self.T = self.T0
+        self.accepted = 0
+        self.seen = 0
+        return self.T
+
+    def update(self, t, accepted, improved):
+        self.accepted += accepted
+        self.seen += 1
+        if self.seen >= self.window:
+            progress = min(t / self.max_iter, 1)
+            target = self.start_rate + (self.end_rate - self.start_rate) * progress
+            if self.accepted / self.seen > target:
+                self.T /= self.factor
+            else:
+                self.T *= self.factor
+            self.accepted = 0
+            self.seen = 0
+        return self.T
+
+
+class ReheatingCooling(HyperbolicCooling):
+    """Hyperbolic schedule that restarts cooling from a fraction of
+       the initial temperature when best energy stagnates
+
+    Parameters
+    ----------
+    T0 : float
+        Initial temperature.
+    r : float
+        Cooling rate.
+    patience : int
+        Iterations without improvement before reheating.
+    reheat : float
+        Temperature after reheating as a fraction of T0.
+
+    """
+    def __init__(self, T0 = 0.03, r = 0.001, patience = 5000, reheat = 0.5):
+        self.T0 = T0
+        self.r = r
+        self.patience = patience
+        self.reheat = reheat
+
+    def start(self, max_iter):
+        self.T_start = self.T0
+        self.t_start = 0
+        self.stagnant = 0
+        return self.T0
+
+    def update(self, t, accepted, improved):
+        self.stagnant = 0 if improved else self.stagnant + 1
+        if self.stagnant >= self.patience:
+            self.T_start = self.reheat * self.T0
+            self.t_start = t
+            self.stagnant = 0
+        return self.T_start / (1 + self.r * (t - self.t_start))
+
+
+class StopCriteria():
+    """When to stop annealing before reaching maximum amount of iterations
+
+    Parameters
+    ----------
+    tolerance : float
+        Stop when energy of current graph is at most tolerance.
+    patience : int
+        Stop after this many iterations without improvement of best energy.
+    time_budget : float
+        Stop after this many seconds.
+
+    """
+    def __init__(self, tolerance = 1e-6, patience = None, time_budget = None):
+        self.tolerance = tolerance
+        self.patience = patience
+        self.time_budget = time_budget
+
+    def start(self, elapsed = 0):
+        """Prepares criteria for a new run
+
+        Parameters
+        ----------
+        elapsed : float
+            Seconds already spent, when a run is resumed.
+
+        """
+        self.start_time = time.time() - elapsed
+        if elapsed == 0:
+            self.stagnant = 0
+
+    def elapsed(self):
+        """Seconds spent since start"""
+        return time.time() - self.start_time
+
+    def update(self, improved):
+        """Records outcome of an iteration
+
+        Parameters
+        ----------
+        improved : Boolean
+            Whether candidate of the iteration has the lowest energy so far.
+
+        """
+        self.stagnant = 0 if improved else self.stagnant + 1
+
+    def done(self, E_cur):
+        """Whether annealing should stop
+
+        Parameters
+        ----------
+        E_cur : float
+            Energy of current graph.
+
+        Returns
+        -------
+        Boolean
+
+        """
+        if E_cur <= self.tolerance:
+            return True
+        if self.patience is not None and self.stagnant >= self.patience:
+            return True
+        if self.time_budget is not None and time.time() - self.start_time >= self.time_budget:
+            return True
+        return False
@@ -0,0 +1,185 @@
+"""
+    Critical thresholds of default dynamics
+
+    For a fixed graph and weights the number of defaults is a step
+    function of net worth (gamma) and of shock size. Instead of
+    simulating every point of a sweep, the steps are located by
+    bisection and the whole curve is returned at once.
+"""
+import numpy as np
+import simulation
+
+
+def solve_steps(evaluate, lo, hi, K, tol = None, grid = 17):
+    """Finds steps of K step functions on [lo, hi]
+
+    Every function is first evaluated on a uniform grid, then every grid
+    interval where the value changes is bisected until it is shorter than
+    tol. All open intervals are evaluated together in one call per round.
+    Steps that cancel each other within one grid interval are not seen.
+
+    Parameters
+    ----------
+    evaluate : function
+        (array of x, array of function indices) -> array of values.
+    lo : float
+        Start of the domain.
+    hi : float
+        End of the domain.
+    K : int
+        Number of functions.
+    tol : float
+        Width of the interval a step is located in, (hi - lo) * 1e-6 by default.
+    grid : int
+        Number of initial grid points, at least 2.
+
+    Returns
+    -------
+    array
+        For every function a tuple
+        0 - thresholds x_1 < ... < x_m
+        1 - values n_0, ..., n_m, where n_k holds on [x_k, x_k+1)
+            and n_0 holds from lo
+
+    """
+    if tol is None:
+        tol = (hi - lo) * 1e-6
+
+    xs = np.linspace(lo, hi, max(grid, 2))
+    values = np.asarray(evaluate(np.repeat(xs, K), np.tile(np.arange(K), xs.size))).reshape(xs.size, K)
+
+    # open intervals (function, x_lo, x_hi, value at x_lo, value at x_hi)
+    open_k, open_lo, open_hi, open_n_lo, open_n_hi = [], [], [], [], []
+    for j in range(xs.size - 1):
+        k = np.flatnonzero(values[j] != values[j + 1])
+        open_k.append(k)
+        open_lo.append(np.full(k.size, xs[j]))
+        open_hi.append(np.full(k.size, xs[j + 1]))
+        open_n_lo.append(values[j, k])
+        open_n_hi.append(values[j + 1, k])
+    k, x_lo, x_hi, n_lo, n_hi = [np.concatenate(x) for x in (open_k, open_lo, open_hi, open_n_lo, open_n_hi)]
+
+    steps = [[] for _ in range(K)]
+    while k.size > 0:
+        done = x_hi - x_lo <= tol
+        for s in np.flatnonzero(done):
+            steps[k[s]].append((x_hi[s], n_hi[s]))
+        k, x_lo, x_hi, n_lo, n_hi = k[~done], x_lo[~done], x_hi[~done], n_lo[~done], n_hi[~done]
+        if k.size == 0:
+            break
+
+        x_mid = (x_lo + x_hi) / 2
+        n_mid = np.asarray(evaluate(x_mid, k))
+
+        left = n_mid != n_lo
+        right = n_mid != n_hi
+        k = np.concatenate((k[left], k[right]))
+        x_lo, x_hi = np.concatenate((x_lo[left], x_mid[right])), np.concatenate((x_mid[left], x_hi[right]))
+        n_lo, n_hi = np.concatenate((n_lo[left], n_mid[right])), np.concatenate((n_mid[left], n_hi[right]))
+
+    curves = []
+    for f in range(K):
+        found = sorted(steps[f])
+        thresholds = np.array([x for x, _ in found])
+        counts = np.array([values[0, f]] + [n for _, n in found], dtype=int)
+        curves.append((thresholds, counts))
+    return curves
+
+
+def curve_at(curve, x):
+    """Evaluates a curve of solve_steps
+
+    Parameters
+    ----------
+    curve : tuple
+        Thresholds and values, one item of output of solve_steps.
+    x : float or array
+        Points inside the solved domain.
+
+    Returns
+    -------
+    int or array
+        Values at x.
+
+    """
+    thresholds, counts = curve
+    return counts[np.searchsorted(thresholds, x, side='right')]
+
+
+def gamma_curves(g, E, theta, shock_size, lo = 0, hi = 0.1, origins = None, tol = None):
+    """Number of defaults as a function of net worth
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Directed graph used for simulation.
+    E : float
+        Total external assets of network.
+    theta : float
+        Interbank assets as percenage of total assets.
+    shock_size : float
+        Initial shock size.
+    lo : float
+        Smallest gamma.
+    hi : float
+        Largest gamma.
+    origins : array
+        Banks where initial shocks are applied, every bank by default.
+    tol : float
+        Precision of thresholds, see solve_steps.
+
+    Returns
+    -------
+    array
+        Curve (thresholds, defaults) for every origin.
+
+    """
+    origins = np.arange(g.vcount()) if origins is None else np.asarray(origins, dtype=int)
+    weights = simulation.apply(g, E, 0, theta)
+    a = weights[0]
+
+    def evaluate(gammas, k):
+        # only c = gamma * a depends on gamma
+        return simulation.simulate_all(g, weights, shock_size, origins[k], np.outer(gammas, a))
+
+    return solve_steps(evaluate, lo, hi, origins.size, tol)
+
+
+def shock_curves(g, E, gamma, theta, lo = 0, hi = None, origins = None, tol = None):
+    """Number of defaults as a function of shock size
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Directed graph used for simulation.
+    E : float
+        Total external assets of network.
+    gamma : float
+        Net worth as percenage of total assets.
+    theta : float
+        Interbank assets as percenage of total assets.
+    lo : float
+        Smallest shock.
+    hi : float
+        Largest shock, assets of the largest bank by default,
+        as shock is capped by assets of the origin.
+    origins : array
+        Banks where initial shocks are applied, every bank by default.
+    tol : float
+        Precision of thresholds, see solve_steps.
+
+    Returns
+    -------
+    array
+        Curve (thresholds, defaults) for every origin.
+
+    """
+    origins = np.arange(g.vcount()) if origins is None else np.asarray(origins, dtype=int)
+    weights = simulation.apply(g, E, gamma, theta)
+    if hi is None:
+        hi = float(np.max(weights[0]))
+
+    def evaluate(shocks, k):
+        return simulation.simulate_all(g, weights, shocks, origins[k])
+
+    return solve_steps(evaluate, lo, hi, origins.size, tol)
@@ -0,0 +1,411 @@
+"""
+    Distributed execution of pool tasks through a work queue server
+
+    A broker process keeps the queue of tasks, worker processes on any
+    host take tasks from it and a client (Multicore_variation,
+    Evaluate_pregenerated, Generate_multicore) submits a batch and
+    collects its results in order of completion. Workers hold a lease
+    on their task and renew it while working, tasks of lost workers
+    are queued again up to a number of retries.
+
+    Start a server, workers on every host and pass the cluster
+    to a command, e.g.:
+
+        python distributed.py server 0.0.0.0 --port 50000
+        python distributed.py worker server-host --port 50000
+        python test_light.py --reproduce-sim --cluster server-host:50000
+
+    Tasks and results are pickled, anyone with the key can run code on
+    the workers. Set the same secret NIER_AUTHKEY for all parts, there is
+    no default, and only serve on trusted networks. Tasks that read or write
+    files (pregenerated graphs) require a filesystem shared by all hosts.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import pickle
+import socket
+import threading
+import time
+import traceback
+import uuid
+from multiprocessing.managers import BaseManager
+
+from progress import Progress
+
+
+def get_authkey(authkey = None):
+    """Given key or key of environment variable NIER_AUTHKEY
+
+    Raises
+    ------
+    ValueError
+        If neither is set.
+
+    """
+    if authkey is None:
+        authkey = os.environ.get("NIER_AUTHKEY")
+    if not authkey:
+        raise ValueError("Set NIER_AUTHKEY to a secret shared by server, workers and clients")
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+class Broker():
+    """Queue of tasks with leases, shared by the server
+
+    Tasks and results are pickled by clients and workers, the broker
+    only moves bytes.
+
+    Parameters
+    ----------
+    lease : float
+        Seconds without heartbeat after which a task is considered lost.
+    retries : int
+        Times a lost task is queued again before it fails.
+
+    """
+    def __init__(self, lease = 60, retries = 3):
+        self.lease = lease
+        self.retries = retries
+        self.changed = threading.Condition()
+        self.pending = collections.deque()
+        self.tasks = {}
+        self.leases = {}
+        self.attempts = {}
+        self.setups = {}
+        self.results = collections.defaultdict(list)
+        self.seen = {}
+        self.next_id = 0
+
+    def expire(self):
+        """Queues tasks with expired leases again, call with lock held"""
+        now = time.time()
+        expired = [task_id for task_id, (_, deadline) in self.leases.items() if deadline < now]
+        for task_id in expired:
+            worker, _ = self.leases.pop(task_id)
+            self.attempts[task_id] += 1
+            batch, _ = self.tasks[task_id]
+            if self.attempts[task_id] > self.retries:
+                del self.tasks[task_id]
+                error = "Task lost %i times, last on worker %s" % (self.attempts[task_id], worker)
+                self.results[batch].append((False, pickle.dumps(error), worker, 0))
+            else:
+                self.pending.appendleft(task_id)
+        if expired:
+            self.changed.notify_all()
+
+    def submit(self, batch, setup, payloads):
+        """Queues a batch of tasks
+
+        Parameters
+        ----------
+        batch : string
+            Identifier of the batch.
+        setup : bytes
+            Pickled (initializer, initargs) run by a worker before tasks of the batch.
+        payloads : array
+            Pickled tasks.
+
+        """
+        with self.changed:
+            self.setups[batch] = setup
+            for payload in payloads:
+                self.tasks[self.next_id] = (batch, payload)
+                self.attempts[self.next_id] = 0
+                self.pending.append(self.next_id)
+                self.next_id += 1
+            self.changed.notify_all()
+
+    def setup(self, batch):
+        return self.setups.get(batch)
+
+    def lease_time(self):
+        """Seconds without heartbeat after which a task is considered lost,
+           workers renew their leases well within it"""
+        return self.lease
+
+    def take(self, worker, timeout = 1.0):
+        """Leases next task to a worker
+
+        Returns
+        -------
+        tuple
+            (task id, batch, payload) or None if no task came within timeout.
+
+        """
+        with self.changed:
+            self.seen[worker] = time.time()
+            deadline = time.time() + timeout
+            while True:
+                self.expire()
+                while self.pending and self.pending[0] not in self.tasks:
+                    self.pending.popleft()
+                if self.pending:
+                    task_id = self.pending.popleft()
+                    self.leases[task_id] = (worker, time.time() + self.lease)
+                    batch, payload = self.tasks[task_id]
+                    return task_id, batch, payload
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.changed.wait(min(remaining, self.lease))
+
+    def renew(self, task_id, worker):
+        """Heartbeat of a worker running a task"""
+        with self.changed:
+            self.seen[worker] = time.time()
+            if task_id in self.leases:
+                self.leases[task_id] = (worker, time.time() + self.lease)
+
+    def complete(self, task_id, worker, ok, value, busy):
+        """Stores result of a task, results of tasks completed before are dropped"""
+        with self.changed:
+            self.seen[worker] = time.time()
+            if task_id not in self.tasks:
+                return
+            batch, _ = self.tasks.pop(task_id)
+            self.leases.pop(task_id, None)
+            self.attempts.pop(task_id, None)
+            self.results[batch].append((ok, value, worker, busy))
+            self.changed.notify_all()
+
+    def collect(self, batch, timeout = 1.0):
+        """Returns results of a batch that arrived since last call, waits up to timeout for one"""
+        with self.changed:
+            deadline = time.time() + timeout
+            while not self.results[batch]:
+                self.expire()
+                remaining = deadline - time.time()
+                if remaining <= 0 or self.results[batch]:
+                    break
+                self.changed.wait(min(remaining, self.lease))
+            results = self.results.pop(batch, [])
+            return results
+
+    def cancel(self, batch):
+        """Drops remaining tasks and setup of a batch"""
+        with self.changed:
+            for task_id in [k for k, (b, _) in self.tasks.items() if b == batch]:
+                del self.tasks[task_id]
+                self.leases.pop(task_id, None)
+                self.attempts.pop(task_id, None)
+            self.setups.pop(batch, None)
+            self.results.pop(batch, None)
+
+    def workers(self):
+        """Number of workers seen within last lease period"""
+        with self.changed:
+            now = time.time()
+            return len([w for w, t in self.seen.items() if now - t <= self.lease])
+
+
+class BrokerManager(BaseManager):
+    pass
+
+
+def parse_address(text, port = 50000):
+    """"host:port" or "host" as address tuple"""
+    host, _, given = text.rpartition(":") if ":" in text else (text, "", "")
+    return host, int(given) if given else port
+
+
+def serve(address, authkey = None, lease = 60, retries = 3):
+    """Runs the broker until interrupted
+
+    Parameters
+    ----------
+    address : tuple
+        (host, port) to listen on.
+    authkey : bytes
+        Key shared by server, workers and clients, NIER_AUTHKEY by default.
+    lease : float
+        Seconds without heartbeat after which a task is considered lost.
+    retries : int
+        Times a lost task is queued again before it fails.
+
+    """
+    authkey = get_authkey(authkey)
+    broker = Broker(lease, retries)
+    BrokerManager.register('broker', callable = lambda: broker)
+    server = BrokerManager(address = address, authkey = authkey).get_server()
+    print("Serving tasks on %s:%i" % server.address)
+    server.serve_forever()
+
+
+def connect(address, authkey = None):
+    """Proxy of the broker at address"""
+    BrokerManager.register('broker')
+    manager = BrokerManager(address = address, authkey = get_authkey(authkey))
+    manager.connect()
+    return manager.broker()
+
+
+def Work_loop(address, authkey):
+    """Takes and runs tasks until the server goes away, runs in a worker process"""
+    broker = connect(address, authkey)
+    # renewals follow lease of the server
+    heartbeat = max(broker.lease_time() / 6, 0.1)
+    worker = "%s:%i" % (socket.gethostname(), os.getpid())
+    current_batch = None
+    running = {}
+
+    def beat():
+        while True:
+            time.sleep(heartbeat)
+            task_id = running.get('task')
+            if task_id is not None:
+                broker.renew(task_id, worker)
+
+    threading.Thread(target = beat, daemon = True).start()
+
+    while True:
+        try:
+            job = broker.take(worker)
+        except (EOFError, ConnectionError):
+            return
+        if job is None:
+            continue
+
+        task_id, batch, payload = job
+        start = time.perf_counter()
+        running['task'] = task_id
+        try:
+            if batch != current_batch:
+                initializer, initargs = pickle.loads(broker.setup(batch))
+                if initializer is not None:
+                    initializer(*initargs)
+                current_batch = batch
+
+            fn, task, star = pickle.loads(payload)
+            value = fn(*task) if star else fn(task)
+            ok = True
+        except Exception:
+            value = traceback.format_exc()
+            ok = False
+        running['task'] = None
+
+        try:
+            broker.complete(task_id, worker, ok, pickle.dumps(value), time.perf_counter() - start)
+        except (EOFError, ConnectionError):
+            return
+
+
+def work(address, authkey = None, processes = None):
+    """Runs worker processes on this host until the server goes away
+
+    Parameters
+    ----------
+    address : tuple
+        (host, port) of the server.
+    authkey : bytes
+        Key shared by server, workers and clients, NIER_AUTHKEY by default.
+    processes : int
+        Number of worker processes, all cores by default.
+
+    """
+    authkey = get_authkey(authkey)
+    processes = processes or multiprocessing.cpu_count()
+    workers = [multiprocessing.Process(target = Work_loop, args = (address, authkey)) for _ in range(processes)]
+    for p in workers:
+        p.start()
+    print("%i workers connected to %s:%i" % ((processes,) + tuple(address)))
+    for p in workers:
+        p.join()
+
+
+class Cluster():
+    """Client of a broker, runs batches of tasks on its workers
+
+    Parameters
+    ----------
+    address : tuple or string
+        (host, port) or "host:port" of the server.
+    authkey : bytes
+        Key shared by server, workers and clients, NIER_AUTHKEY by default.
+
+    """
+    def __init__(self, address, authkey = None):
+        self.address = parse_address(address) if isinstance(address, str) else tuple(address)
+        self.authkey = get_authkey(authkey)
+        self.broker = connect(self.address, self.authkey)
+
+    def imap(self, fn, tasks, label = "tasks", star = False, size = None, total = None, initializer = None, initargs = ()):
+        """Runs tasks on workers and yields results as they complete,
+           same as progress.imap_progress on a pool
+
+        Parameters
+        ----------
+        fn : function
+            Module level task function.
+        tasks : array
+            Arguments of tasks.
+        label : string
+            Name of counted units in printed lines.
+        star : Boolean
+            Whether tasks are tuples of arguments, as in starmap.
+        size : function
+            Number of counted units in a result, 1 by default.
+        total : int
+            Total number of counted units, number of tasks by default.
+        initializer : function
+            Module level function run by a worker before tasks of this batch.
+        initargs : tuple
+            Arguments of initializer.
+
+        Returns
+        -------
+        generator
+            Results in order of completion.
+
+        """
+        tasks = list(tasks)
+        batch = uuid.uuid4().hex
+        self.broker.submit(batch, pickle.dumps((initializer, initargs)),
+                           [pickle.dumps((fn, task, star)) for task in tasks])
+
+        progress = Progress(total if total is not None else len(tasks), label, max(self.broker.workers(), 1))
+        remaining = len(tasks)
+        try:
+            while remaining > 0:
+                for ok, value, worker, busy in self.broker.collect(batch):
+                    remaining -= 1
+                    value = pickle.loads(value)
+                    if not ok:
+                        raise RuntimeError("Task failed on worker:\n%s" % value)
+                    progress.workers = max(self.broker.workers(), 1)
+                    progress.update(size(value) if size is not None else 1, worker, busy)
+                    yield value
+        finally:
+            self.broker.cancel(batch)
+        progress.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Work queue server and workers for distributed simulation and generation')
+
+    parser.add_argument('role', choices=['server', 'worker'],
+                        help='Run the task server or workers connecting to it')
+
+    parser.add_argument('host', nargs='?', default='127.0.0.1',
+                        help='Server host, for server the interface to listen on')
+
+    parser.add_argument('--port', dest='port', type=int, default=50000)
+
+    parser.add_argument('--processes', dest='processes', type=int, default=None,
+                        help='Worker processes on this host, all cores by default')
+
+    parser.add_argument('--lease', dest='lease', type=float, default=None,
+                        help='Server only: seconds without heartbeat after which a task is queued again, 60 by default')
+
+    parser.add_argument('--retries', dest='retries', type=int, default=None,
+                        help='Server only: times a lost task is queued again before it fails, 3 by default')
+
+    args = parser.parse_args()
+
+    if args.role == 'server':
+        serve((args.host, args.port), lease = args.lease or 60, retries = 3 if args.retries is None else args.retries)
+    else:
+        if args.lease is not None or args.retries is not None:
+            parser.error("--lease and --retries are set on the server, workers follow its lease")
+        work((args.host, args.port), processes = args.processes)
@@ -3,11 +3,14 @@
 """
 import simulation
 import os
+import random
 from igraph import Graph
 import multiprocessing
-import time
 import numpy as np
 from generate_graph import Make_directed
+from graph_library import GraphLibrary
+from progress import imap_progress
+from result_cache import make_key, file_identity, function_name
 import matplotlib.pyplot as plt
 
 
@@ -22,20 +25,119 @@ def Simulate_single(g, simParams):
     N = g.vcount()
 
     weights = simulation.apply(g, E, gamma, theta)
-    defaults = 0
-    for bank in range(N):
-        defaults += simulation.simulate(g, weights, shock_size, bank)
+    defaults = simulation.simulate_all(g, weights, shock_size)
 
-    return defaults / N
+    return np.sum(defaults) / N
 
 
-def Evaluate_pregenerated(base_path, evalParam, simParams):
+# state of a worker process, set by Init_worker
+worker = {}
+
+
+def Init_worker(evalParam, simParams):
+    """Stores evaluation arguments in a worker process, so that tasks carry only graph locations"""
+    worker['evalParam'] = evalParam
+    worker['simParams'] = simParams
+    worker['libraries'] = {}
+    # forked workers inherit state of the parent, edge directions must differ
+    random.seed()
+
+
+def Load_graph(path, index):
+    """Loads pickled graph (index None) or graph index of a graph library"""
+    if index is None:
+        return Graph.Read_Pickle(path)
+
+    if path not in worker['libraries']:
+        worker['libraries'][path] = GraphLibrary(path)
+    return worker['libraries'][path].graph(index)
+
+
+def Evaluate_single(task):
+    """Loads, directs, measures and simulates a single graph
+
+    Parameters
+    ----------
+    task : tuple
+        0 - task number
+        1 - path of pickled graph or graph library
+        2 - index of graph in library or None
+        3 - seed of edge directions or None, see Direction_seed
+
+    Returns
+    -------
+    tuple
+        0 - task number
+        1 - evaluated parameter
+        2 - fraction of defaults
+        3 - number of nodes
+
+    """
+    number, path, index, seed = task
+    undirected_g = Load_graph(path, index)
+    rng = None if seed is None else random.Random(seed)
+    directed_g = Make_directed(undirected_g, rng)
+    param = worker['evalParam'](undirected_g, directed_g)
+    return number, param, Simulate_single(directed_g, worker['simParams']), directed_g.vcount()
+
+
+def Direction_seed(seed, base_path, path, index):
+    """Seed of edge directions of a graph, from its path relative to
+       base_path, so that it does not change when the ensemble is moved
+       or mounted elsewhere
+
+    Parameters
+    ----------
+    seed : int
+        Seed of the evaluation or None.
+    base_path : string
+        Directory the graphs were found in.
+    path : string
+        Path of pickled graph or graph library.
+    index : int
+        Index of graph in library or None.
+
+    Returns
+    -------
+    string
+        Seed for random.Random or None for fresh entropy.
+
+    """
+    if seed is None:
+        return None
+    relative = os.path.relpath(path, base_path).replace(os.sep, "/")
+    return "%s:%s:%s" % (seed, relative, index)
+
+
+def Find_graphs(base_path):
+    """Lists pregenerated graphs without loading them
+
+    Parameters
+    ----------
+    base_path : string
+        Directory searched for pickled graphs (*.graph) and graph libraries (*.glib).
+
+    Returns
+    -------
+    tuple
+        0 - array of groups, a directory or library each
+        1 - array of tasks (path, index in library or None, group)
+
+    """
     groups = []
-    graphs = []
-    N = 0
-    print("Loading graphs...")
+    tasks = []
 
     for dirpath, dirnames, filenames in os.walk(base_path):
+        # directories packed into graph libraries are read from the library
+        dirnames[:] = [d for d in dirnames if not os.path.exists(os.path.join(dirpath, d) + ".glib")]
+
+        for filename in [f for f in filenames if f.endswith(".glib")]:
+            path = os.path.join(dirpath, filename)
+            group = len(groups)
+            groups.append(path)
+            tasks += [(path, k, group) for k in range(len(GraphLibrary(path)))]
+
+        filenames = [f for f in filenames if f.endswith(".graph")]
         if len(filenames) < 1:
             continue
 
@@ -45,39 +147,107 @@ def Evaluate_pregenerated(base_path, evalParam, simParams):
             group = len(groups)
             groups.append(dirpath)
 
-        for filename in [f for f in filenames if f.endswith(".graph")]:
-            path = os.path.join(dirpath, filename)
-            undirected_g = Graph.Read_Pickle(path)
-            directed_g = Make_directed(undirected_g)
-            N = max(directed_g.vcount(), N)
-            param = evalParam(undirected_g, directed_g)
-            graphs.append((directed_g, group, param))
+        tasks += [(os.path.join(dirpath, filename), None, group) for filename in filenames]
+
+    return groups, tasks
 
-    if len(graphs) < 1:
+
+def Evaluate_pregenerated(base_path, evalParam, simParams, processes = None, cache = None, seed = None, cluster = None):
+    """Runs default simulation on every pregenerated graph
+
+    Graphs are loaded in worker processes, the parent only lists files.
+
+    Parameters
+    ----------
+    base_path : string
+        Directory searched for pickled graphs (*.graph) and graph libraries (*.glib).
+    evalParam : function
+        Module level function (undirected graph, directed graph) -> parameter value.
+    simParams : tuple
+        (E, gamma, theta) or (E, gamma, theta, shock_size).
+    processes : int
+        Number of worker processes, all cores by default.
+    cache : result_cache.ResultCache
+        Store of results, graphs found there are not simulated again.
+    seed : int
+        Seed of edge directions, fresh entropy by default.
+    cluster : distributed.Cluster
+        Run tasks on workers of a work queue server instead of local
+        processes, base_path must be on a filesystem shared with them.
+
+    Returns
+    -------
+    tuple
+        0 - mean parameter value of every group, sorted
+        1 - fractions of defaults of every group, in the same order
+        2 - largest number of nodes
+
+    """
+    print("Finding graphs...")
+    groups, tasks = Find_graphs(base_path)
+
+    if len(tasks) < 1:
         print("No graphs found")
         return [], []
 
-    print("Loaded %i graphs" % len(graphs))
-    print("Launching tasks...")
-
-    pool = multiprocessing.Pool()
-    rs = pool.starmap_async(Simulate_single, [(x[0], simParams) for x in graphs])
+    print("Found %i graphs" % len(tasks))
 
-    pool.close()
+    params = [None] * len(tasks)
+    defaults = [None] * len(tasks)
+    N = 0
+    missing = list(range(len(tasks)))
+    if cache is not None:
+        identities = {}
+        keys = []
+        for path, index, _ in tasks:
+            if path not in identities:
+                identities[path] = file_identity(path)
+            keys.append(make_key("evaluate", identities[path], index, function_name(evalParam), list(simParams), seed))
+        found = cache.get_many(keys)
+        missing = []
+        for number, key in enumerate(keys):
+            if key in found:
+                params[number], defaults[number], n = found[key]
+                N = max(n, N)
+            else:
+                missing.append(number)
+        print("Found %i results in cache" % (len(tasks) - len(missing)))
 
-    while (True):
-      if (rs.ready()): break
-      remaining = rs._number_left
-      print("Waiting for %i tasks to complete..." % (remaining), end="\r")
-      time.sleep(1)
+    processes = processes or multiprocessing.cpu_count()
+    chunksize = max(1, min(16, len(missing) // (processes * 4)))
 
-    defaults = rs.get()
+    if len(missing) > 0:
+        print("Launching tasks...")
+        jobs = [(number, os.path.abspath(tasks[number][0]), tasks[number][1],
+                 Direction_seed(seed, base_path, tasks[number][0], tasks[number][1])) for number in missing]
+        pool = None
+        if cluster is not None:
+            completed = cluster.imap(Evaluate_single, jobs, "graphs", initializer = Init_worker, initargs = (evalParam, simParams))
+        else:
+            pool = multiprocessing.Pool(processes, Init_worker, (evalParam, simParams))
+            completed = imap_progress(pool, Evaluate_single, jobs, "graphs", chunksize, workers = processes)
+        try:
+            pending = []
+            for number, param, default, n in completed:
+                params[number] = param
+                defaults[number] = default
+                N = max(n, N)
+                if cache is not None:
+                    pending.append((keys[number], (param, default, n)))
+                    if len(pending) >= 64:
+                        cache.put_many(pending)
+                        pending = []
+            if cache is not None:
+                cache.put_many(pending)
+        finally:
+            if pool is not None:
+                pool.terminate()
 
     defaults_per_group = [[] for _ in range(len(groups))]
     values_per_group = [[0, 0] for _ in range(len(groups))]
-    for i, info in enumerate(graphs):
-        defaults_per_group[info[1]].append(defaults[i])
-        values_per_group[info[1]].append(info[2])
+    for i, task in enumerate(tasks):
+        defaults_per_group[task[2]].append(defaults[i])
+        values_per_group[task[2]].append(params[i])
 
 
     mean_values = np.mean(values_per_group, 1)
@@ -13,6 +13,438 @@
 import igraph
 import math
 import random
+import time
+import multiprocessing
+import os
+import pickle
+from collections import OrderedDict
+from cooling import HyperbolicCooling, StopCriteria
+import kernels
+
+def save_checkpoint(path, data):
+    """Atomically pickles checkpoint data, so that an interruption
+       never leaves a partially written checkpoint
+
+    Parameters
+    ----------
+    path : string
+        Checkpoint file.
+    data : dict
+        Data to save.
+
+    """
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path):
+    """Loads checkpoint saved with save_checkpoint
+
+    Parameters
+    ----------
+    path : string
+        Checkpoint file.
+
+    Returns
+    -------
+    dict
+        Saved data or None if there is no checkpoint.
+
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def fingerprint(edges):
+    """Cheap fingerprint of an undirected edge set, XOR of edge hashes,
+       which can be updated in O(1) when an edge is added or removed
+
+    Parameters
+    ----------
+    edges : iterable
+        Edges as pairs of vertices.
+
+    Returns
+    -------
+    int
+        Fingerprint, independent of edge order and orientation.
+
+    """
+    value = 0
+    for u, v in edges:
+        value ^= hash((min(u, v), max(u, v)))
+    return value
+
+
+class IndexedSet():
+    """Set that also supports choosing a random element in O(1)
+
+    Parameters
+    ----------
+    items : iterable
+        Initial elements.
+
+    """
+    def __init__(self, items = ()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        position = self.positions.pop(item, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def choice(self):
+        return self.items[random.randrange(len(self.items))]
+
+    def sample(self, k):
+        return [self.items[i] for i in random.sample(range(len(self.items)), k)]
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class GraphState():
+    """Incrementally tracked state of a simple undirected graph.
+       Density and average local clustering are available in O(1)
+       and are updated in O(deg) on every edge insertion or deletion.
+       Changes are journaled on the Python side, so that they can be
+       rolled back instead of copying the graph. igraph rebuilds its
+       edge index on every change, so the igraph graph is brought up to
+       date with a single deletion and a single insertion only when it
+       is read, see sync. Edges, non-edges and vertices for mutations
+       are sampled in O(1) or O(deg) expected time.
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Simple undirected graph to track, modified in place.
+
+    Attributes
+    ----------
+    g : igraph.Graph
+        Tracked graph, synced when read.
+    unsynced : dict
+        Edges (u, v) with u < v added (True) or deleted (False) since last sync.
+    adj : array
+        Set of neighbors of every vertex.
+    triangles : array
+        Number of triangles every vertex belongs to.
+    local : array
+        Local clustering coefficient of every vertex, None for
+        vertices with less than 2 neighbors.
+    clustering_sum : float
+        Sum of local clustering coefficients.
+    clustered : int
+        Number of vertices with local clustering coefficient.
+    edges : int
+        Number of edges.
+    edge_list : IndexedSet
+        Edges as (u, v) with u < v.
+    with_neighbors : IndexedSet
+        Vertices with at least 1 neighbor.
+    hubs : IndexedSet
+        Vertices with more than 2 neighbors.
+    fingerprint : int
+        Fingerprint of the edge set.
+    journal : array
+        Edges added (True, u, v) or deleted (False, u, v) since last commit.
+    N : int
+        Number of vertices.
+
+    """
+    def __init__(self, g):
+        self.graph = g
+        self.unsynced = {}
+        self.N = g.vcount()
+        self.adj = [set(a) for a in g.get_adjlist()]
+        self.edges = g.ecount()
+        self.journal = []
+
+        self.edge_list = IndexedSet(tuple(sorted(e)) for e in g.get_edgelist())
+        self.with_neighbors = IndexedSet(v for v in range(self.N) if len(self.adj[v]) > 0)
+        self.hubs = IndexedSet(v for v in range(self.N) if len(self.adj[v]) > 2)
+        self.fingerprint = fingerprint(self.edge_list)
+
+        self.triangles = [0] * self.N
+        for u in range(self.N):
+            for v in self.adj[u]:
+                if v > u:
+                    for w in self.adj[u] & self.adj[v]:
+                        if w > v:
+                            self.triangles[u] += 1
+                            self.triangles[v] += 1
+                            self.triangles[w] += 1
+
+        self.local = [None] * self.N
+        self.clustering_sum = 0
+        self.clustered = 0
+        self.update_local(range(self.N))
+
+    def update_local(self, vertices):
+        """Recalculates local clustering coefficients of given vertices
+
+        Parameters
+        ----------
+        vertices : iterable
+            Vertices whose neighborhood has changed.
+
+        """
+        for v in vertices:
+            if self.local[v] is not None:
+                self.clustering_sum -= self.local[v]
+                self.clustered -= 1
+
+            k = len(self.adj[v])
+            if k > 1:
+                self.local[v] = self.triangles[v] / (k * (k - 1) / 2)
+                self.clustering_sum += self.local[v]
+                self.clustered += 1
+            else:
+                self.local[v] = None
+
+    def change(self, added, u, v):
+        """Adds or deletes edge u-v without journaling it
+
+        Parameters
+        ----------
+        added : Boolean
+            Whether edge is added or deleted.
+        u : int
+        v : int
+
+        """
+        edge = (min(u, v), max(u, v))
+        if self.unsynced.get(edge, added) != added:
+            # reverts a change not yet applied to the igraph graph
+            del self.unsynced[edge]
+        else:
+            self.unsynced[edge] = added
+
+        if added:
+            common = self.adj[u] & self.adj[v]
+            self.adj[u].add(v)
+            self.adj[v].add(u)
+            self.edge_list.add(edge)
+            self.fingerprint ^= hash(edge)
+            delta = 1
+        else:
+            self.adj[u].discard(v)
+            self.adj[v].discard(u)
+            common = self.adj[u] & self.adj[v]
+            self.edge_list.remove(edge)
+            self.fingerprint ^= hash(edge)
+            delta = -1
+
+        for w in (u, v):
+            degree = len(self.adj[w])
+            if degree > 0:
+                self.with_neighbors.add(w)
+            else:
+                self.with_neighbors.remove(w)
+            if degree > 2:
+                self.hubs.add(w)
+            else:
+                self.hubs.remove(w)
+
+        for w in common:
+            self.triangles[w] += delta
+        self.triangles[u] += delta * len(common)
+        self.triangles[v] += delta * len(common)
+        self.edges += delta
+        self.update_local(common | {u, v})
+
+    def sync(self):
+        """Applies changes since last sync to the igraph graph,
+           with a single deletion and a single insertion"""
+        if len(self.unsynced) == 0:
+            return
+        deleted = [edge for edge, added in self.unsynced.items() if not added]
+        if deleted:
+            self.graph.delete_edges(self.graph.get_eids(deleted))
+        inserted = [edge for edge, added in self.unsynced.items() if added]
+        if inserted:
+            self.graph.add_edges(inserted)
+        self.unsynced = {}
+
+    @property
+    def g(self):
+        self.sync()
+        return self.graph
+
+    def add_edge(self, u, v):
+        """Adds edge u-v"""
+        self.change(True, u, v)
+        self.journal.append((True, u, v))
+
+    def delete_edge(self, u, v):
+        """Deletes edge u-v"""
+        self.change(False, u, v)
+        self.journal.append((False, u, v))
+
+    def commit(self):
+        """Accepts changes made since last commit"""
+        self.journal = []
+
+    def rollback(self):
+        """Reverts changes made since last commit"""
+        for added, u, v in reversed(self.journal):
+            self.change(not added, u, v)
+        self.journal = []
+
+    def replay(self, journal):
+        """Repeats journaled changes, e.g. ones that were rolled back
+
+        Parameters
+        ----------
+        journal : array
+            Changes in the same format as journal attribute.
+
+        """
+        for added, u, v in journal:
+            self.change(added, u, v)
+            self.journal.append((added, u, v))
+
+    def connected(self, u, v):
+        """Whether edge u-v exists"""
+        return v in self.adj[u]
+
+    def random_edge(self):
+        """Uniformly chosen edge as (u, v) in random orientation"""
+        u, v = self.edge_list.choice()
+        return (u, v) if random.random() < 0.5 else (v, u)
+
+    def random_non_edge(self, max_tries = 100):
+        """Uniformly chosen pair of distinct unconnected vertices
+
+        Parameters
+        ----------
+        max_tries : int
+            Maximum number of rejected pairs.
+
+        Returns
+        -------
+        tuple
+            Pair (u, v) or None if none was found.
+
+        """
+        if self.N < 2 or self.edges >= self.N * (self.N - 1) // 2:
+            return None
+        for _ in range(max_tries):
+            u, v = random.sample(range(self.N), 2)
+            if v not in self.adj[u]:
+                return u, v
+        return None
+
+    def random_neighbors(self, v, k = 1):
+        """k distinct uniformly chosen neighbors of v, independent
+           of iteration order of the set, so that runs are reproducible"""
+        return random.sample(sorted(self.adj[v]), k)
+
+    def key(self):
+        """Key of the graph for energy cache"""
+        return self.N, self.edges, self.fingerprint
+
+    def snapshot(self):
+        """Edges of the graph, enough to restore it with igraph.Graph(N, edges)"""
+        return list(self.edge_list)
+
+    def density(self):
+        """Density of the graph, same as igraph.Graph.density"""
+        if self.N < 2:
+            return math.nan
+        return self.edges / (self.N * (self.N - 1) / 2)
+
+    def clustering(self):
+        """Average local clustering coefficient, same as
+           igraph.Graph.transitivity_avglocal_undirected"""
+        if self.clustered == 0:
+            return math.nan
+        return self.clustering_sum / self.clustered
+
+
+class GraphMetrics():
+    """Metrics of a single graph, each computed at most once and
+       shared by all targets evaluated on the graph
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Graph to measure, not modified.
+    state : GraphState
+        Tracked state of g, density and clustering are read from it.
+        Its igraph graph is synced only for metrics that need igraph.
+
+    Attributes
+    ----------
+    values : dict
+        Already computed metrics.
+    g
+    state
+
+    """
+    def __init__(self, g, state = None):
+        self.g = g
+        self.state = state
+        self.values = {}
+
+    def get(self, name, compute):
+        if name not in self.values:
+            self.values[name] = compute()
+        return self.values[name]
+
+    def graph(self):
+        """Measured graph as igraph.Graph"""
+        return self.state.g if self.state is not None else self.g
+
+    def density(self):
+        if self.state is not None:
+            return self.state.density()
+        return self.get('density', self.g.density)
+
+    def clustering(self):
+        if self.state is not None:
+            return self.state.clustering()
+        return self.get('clustering', self.g.transitivity_avglocal_undirected)
+
+    def apl(self):
+        return self.get('apl', lambda: self.graph().average_path_length())
+
+    def components(self):
+        return self.get('components', lambda: len(self.graph().components()))
+
+    def simple(self):
+        """Graph without loops and multiple edges"""
+        return self.get('simple', lambda: self.graph() if self.graph().is_simple() else self.graph().copy().simplify())
+
+    def dendrogram(self):
+        """Fast greedy community dendrogram of simple graph"""
+        return self.get('dendrogram', lambda: self.simple().community_fastgreedy())
+
+    def communities(self, n):
+        """Clustering into n communities from the dendrogram"""
+        return self.get(('communities', n), lambda: self.dendrogram().as_clustering(n))
+
 
 class GraphGenerator():
     """Short summary.
@@ -23,18 +455,27 @@ class GraphGenerator():
         Array of tuples with targets that the graph should approach.
     verbose : Boolean
         Should the progress be printed.
+    cache_size : int
+        Maximum number of graph energies remembered.
 
     Attributes
     ----------
     weightsum : float
         Storing weight sum for weight normalization.
+    energy_cache : OrderedDict
+        Least recently used energies keyed by graph fingerprint.
     verbose
     targets
+    cache_size
 
     """
-    def __init__(self, targets, verbose = True):
+    def __init__(self, targets, verbose = True, cache_size = 10000):
         self.verbose = verbose
         self.targets = targets
+        self.cache_size = cache_size
+        self.energy_cache = OrderedDict()
+        # generation_stats.GenerationStats of a running annealing, if collected
+        self.stats = None
 
         self.weightsum = 0
         for i, target in enumerate(self.targets):
@@ -48,7 +489,13 @@ class GraphGenerator():
         if self.weightsum == 0:
             self.weightsum = 1
 
-    def evalParameter(self, fn, g, target):
+    def __getstate__(self):
+        # cache is not sent to other processes
+        state = self.__dict__.copy()
+        state['energy_cache'] = OrderedDict()
+        return state
+
+    def evalParameter(self, fn, g, target, state = None, metrics = None):
         """Evaluates given parameter and the matching score
 
         Parameters
@@ -59,6 +506,10 @@ class GraphGenerator():
             Graph which parameter is evaluated.
         target : mixed
             Target value for given parameter.
+        state : GraphState
+            Tracked state of g, used for incrementally tracked parameters.
+        metrics : GraphMetrics
+            Metrics of g shared with other targets.
 
         Returns
         -------
@@ -70,31 +521,32 @@ class GraphGenerator():
         map_fn = 'l_scale'
         value = 0
 
+        if metrics is None:
+            metrics = GraphMetrics(g, state)
+
         if fn == 'density':
-            value = g.density()
+            value = metrics.density()
             map_fn = 's_scale'
         elif fn == 'clustering':
-            clust = g.transitivity_avglocal_undirected()
+            clust = metrics.clustering()
             if  math.isnan(clust):
                 return 0, 0
             value = clust
             map_fn = 's_scale'
         elif fn == 'apl': #average path length
-            value = g.average_path_length()
+            value = metrics.apl()
             if  math.isnan(value):
                 return 0, 0
         elif fn == 'components':
-            value = len(g.components())
+            value = metrics.components()
         elif fn == 'communities':
-            if (len(g.components()) > 1):
+            if (metrics.components() > 1):
                 return 0, 0
-            g.simplify()
-            value = g.community_fastgreedy().optimal_count
+            value = metrics.dendrogram().optimal_count
         elif fn == 'modularity':
-            if (len(g.components()) > 1):
+            if (metrics.components() > 1):
                 return 0, 0
-            g.simplify()
-            communities = g.community_fastgreedy().as_clustering(target[0])
+            communities = metrics.communities(target[0])
             value = communities.modularity
             target = target[1]
             map_fn = 's_scale'
@@ -106,13 +558,16 @@ class GraphGenerator():
         else:
             return 1 - abs(target - value), value
 
-    def graph_energy(self, g):
-        """Calcualtes energy of given graph
+    def graph_energy(self, g, state = None):
+        """Calcualtes energy of given graph, energies of recently
+           evaluated graphs are taken from cache
 
         Parameters
         ----------
         g : igraph.Graph
             Graph to evaluate
+        state : GraphState
+            Tracked state of g.
 
         Returns
         -------
@@ -120,12 +575,34 @@ class GraphGenerator():
             Graph energy where 0 means that graph matches all target parameters
 
         """
+        if state is None:
+            key = (g.vcount(), g.ecount(), fingerprint(g.get_edgelist()))
+        else:
+            key = state.key()
+
+        if self.stats is not None:
+            self.stats.cache_lookup(key in self.energy_cache)
+
+        if key in self.energy_cache:
+            self.energy_cache.move_to_end(key)
+            return self.energy_cache[key]
+
         psi = 0
 
+        metrics = GraphMetrics(g, state)
         for target in self.targets:
-            psi += target[2] * self.evalParameter(target[0], g, target[1])[0]
+            if self.stats is not None:
+                start = time.perf_counter()
+            psi += target[2] * self.evalParameter(target[0], g, target[1], state, metrics)[0]
+            if self.stats is not None:
+                self.stats.time_eval(target[0], time.perf_counter() - start)
+
+        energy = 1 - psi / self.weightsum;
 
-        return 1 - psi / self.weightsum;
+        self.energy_cache[key] = energy
+        if len(self.energy_cache) > self.cache_size:
+            self.energy_cache.popitem(last = False)
+        return energy
 
     def print(self, g):
         """Prints graph's matching to given target parameters
@@ -135,13 +612,14 @@ class GraphGenerator():
         g : igraph.Graph
 
         """
+        metrics = GraphMetrics(g)
         for target in self.targets:
-            value = self.evalParameter(target[0], g, target[1])
+            value = self.evalParameter(target[0], g, target[1], metrics = metrics)
             if isinstance(target[1], tuple):
                 target = (target[0], target[1][1], target[2])
             print("%s %f/%f" % (target[0], value[1], target[1]))
 
-    def mutate(self, g, count = 5, local = None):
+    def mutate(self, g, count = 5, local = None, state = None, max_tries = 100):
         """Perform n random mutations on the graph
            Mutations [0, 1, 2, 3] based on Kashirin (2014)
            Mutation [4] based on Colman & Rodgers (2014)
@@ -154,6 +632,13 @@ class GraphGenerator():
             Number of mutations.
         local : Boolean
             Whether to perform a local or global modification.
+        state : GraphState
+            Tracked state of g, changes are applied through it.
+            Created for g if not given.
+        max_tries : int
+            Maximum number of rejected proposals of a rewiring, as in
+            GraphState.random_non_edge. The mutation is skipped when
+            no valid proposal is found.
 
         """
         if local is None:
@@ -164,86 +649,87 @@ class GraphGenerator():
         else:
             modifications = [0, 1, 2]
 
-        N = g.vcount()
+        own_state = state is None
+        if own_state:
+            state = GraphState(g)
 
         for _ in range(count):
             [s] = random.sample(modifications, 1)
-
-            adjl = g.get_adjlist()
-            with_neighbors = [(i, a) for i, a in enumerate(adjl) if len(a) > 0]
-            neighbors_c = [len(a) for a in adjl]
-            min_n = min(neighbors_c)
-            max_n = max(neighbors_c)
+            if self.stats is not None:
+                start = time.perf_counter()
 
             if s == 0:
                 # removes random edge
-                if max_n > 0:
-                    [node] = random.sample(with_neighbors, 1)
-                    [j] = random.sample(node[1], 1)
-                    g.delete_edges([(node[0],j)])
+                if state.edges > 0:
+                    i = state.with_neighbors.choice()
+                    [j] = state.random_neighbors(i, 1)
+                    state.delete_edge(i, j)
             elif s == 1:
                 # adds random edge
-                i, j = random.sample(range(N), 2)
-                if not g.are_connected(i, j):
-                    g.add_edge(i, j)
+                pair = state.random_non_edge()
+                if pair is not None:
+                    state.add_edge(*pair)
             elif s == 2:
                 # Global rewire
                 # choosing 4 vertices so that there are
                 # only edges i->j and m->n
                 # and transforming them to edges m->j and i->n
-                if len(with_neighbors) > 2:
-                    max_tries = len(with_neighbors) ** 2
-                    i, m = random.sample(with_neighbors, 2)
-                    [j] = random.sample(i[1], 1)
-                    i = i[0]
-                    [n] = random.sample(m[1], 1)
-                    m = m[0]
-                    while max_tries > 0 and (g.are_connected(i, m) or g.are_connected(i, n) or g.are_connected(j, m) or g.are_connected(j, n)):
-                        i, m = random.sample(with_neighbors, 2)
-                        [j] = random.sample(i[1], 1)
-                        i = i[0]
-                        [n] = random.sample(m[1], 1)
-                        m = m[0]
-                        max_tries -= 1
-                    if max_tries > 0:
-                        g.delete_edges([(i,j), (m, n)])
-                        g.add_edge(m, j)
-                        g.add_edge(i, n)
+                if len(state.with_neighbors) > 2:
+                    for _ in range(max_tries):
+                        i, j = state.random_edge()
+                        m, n = state.random_edge()
+                        if not (state.connected(i, m) or state.connected(i, n) or state.connected(j, m) or state.connected(j, n)):
+                            break
+                    else:
+                        i = None
+                    if i is not None:
+                        state.delete_edge(i, j)
+                        state.delete_edge(m, n)
+                        state.add_edge(m, j)
+                        state.add_edge(i, n)
             elif s == 3:
                 # Connecting local nodes
                 # Making connection between random vertex i
                 # and j, so that distance d between i and j is 1<d<5
-                if len(with_neighbors) > 1:
-                    [node] = random.sample(with_neighbors, 1)
-                    forder = set(node[1])
-                    lookup = set(node[1])
+                if len(state.with_neighbors) > 1:
+                    node = state.with_neighbors.choice()
+                    forder = state.adj[node]
+                    lookup = set(forder)
+                    frontier = set(forder)
                     for _ in range(3):
-                        for v in lookup.copy():
-                            lookup.update(adjl[v])
+                        frontier = set().union(*(state.adj[v] for v in frontier)) - lookup
+                        lookup.update(frontier)
                     local = lookup.difference(forder)
+                    # vertex itself is not at distance 1<d<5
+                    local.discard(node)
                     if len(local) > 1:
-                        [j] = random.sample(local, 1)
-                        g.add_edge(node[0], j)
+                        [j] = random.sample(sorted(local), 1)
+                        state.add_edge(node, j)
             elif s == 4:
                 # Local rewiring
                 # Choosing 3 vertices with only 2 edges
                 # and adding the missing edge but deleting one
                 # of initial edges
-                if max_n > 2:
-                    max_tries = len(with_neighbors) ** 2
-                    while max_tries > 0:
-                        max_tries -= 1
-                        [i] = random.sample(with_neighbors, 1)
+                if len(state.hubs) > 0:
+                    for _ in range(max_tries):
+                        i = state.hubs.choice()
+                        [j, k] = state.random_neighbors(i, 2)
+
+                        if not state.connected(j, k):
+                            break
+                    else:
+                        i = None
 
-                        if len(i[1]) > 2:
-                            [j, k] = random.sample(i[1], 2)
+                    if i is not None:
+                        state.delete_edge(i, j)
+                        state.add_edge(j, k)
 
-                            if not g.are_connected(j, k):
-                                break
+            if self.stats is not None:
+                self.stats.time_move(s, time.perf_counter() - start)
 
-                    if max_tries > 0:
-                        g.delete_edges([(i[0],j)])
-                        g.add_edge(j, k)
+        if own_state:
+            # g is modified in place
+            state.sync()
 
     def update_temperature(self, T0, t, r):
         """Updates simulated annealing temperature for next iteration
@@ -265,7 +751,7 @@ class GraphGenerator():
         """
         return T0 / (1 + r * t)
 
-    def simulated_annealing(self, g, T0 = 0.03, r = 0.001, max_iter = 100000):
+    def simulated_annealing(self, g, T0 = 0.03, r = 0.001, max_iter = 100000, schedule = None, stop = None, checkpoint = None, checkpoint_every = 10000, stats = None, resume = False):
         """Simulated annealing approach for graph generation.
 
         Parameters
@@ -278,6 +764,24 @@ class GraphGenerator():
             Cooling rate.
         max_iter : type
             Maximum amount of iterations.
+        schedule : cooling schedule
+            Schedule from cooling module, by default
+            HyperbolicCooling(T0, r) as in update_temperature.
+        stop : cooling.StopCriteria
+            Early stopping criteria, by default stops when energy
+            reaches 1e-6.
+        checkpoint : string
+            File where annealing state is saved every checkpoint_every
+            iterations.
+        checkpoint_every : int
+            Iterations between checkpoints.
+        stats : generation_stats.GenerationStats
+            Collects evaluation and mutation times, acceptance rates
+            and energy trajectory of the run. Not collected by default.
+        resume : Boolean
+            Continue from checkpoint if it exists. A checkpoint saved by
+            a chain with other targets, number of nodes or max_iter is
+            discarded.
 
         Returns
         -------
@@ -288,28 +792,78 @@ class GraphGenerator():
         """
         print_step = int(max_iter / 1000)
         next_print = 0
-        T = T0
-        t = 0
 
-        min_t =  self.update_temperature(T0, max_iter, r)
+        if schedule is None:
+            schedule = HyperbolicCooling(T0, r)
+        if stop is None:
+            stop = StopCriteria()
+
+        T = schedule.start(max_iter)
+        stop.start()
+        t = 0
 
         E_best = 100
         best_g = g
+        best_edges = None
+
+        self.stats = stats
+
+        # candidates are mutated in place and rolled back when rejected
+        state = GraphState(g.copy())
+        g = state.g
+
+        # energy of accepted candidate is carried forward
+        E_cur = self.graph_energy(g, state)
+
+        saved = load_checkpoint(checkpoint) if checkpoint is not None and resume else None
+        if saved is not None and (saved.get('targets') != self.targets or saved.get('N') != state.N
+                                  or saved.get('max_iter') != max_iter):
+            print("Discarding checkpoint %s of a different chain" % checkpoint)
+            saved = None
+        if saved is not None:
+            self.energy_cache.clear()
+            state = saved['state']
+            g = state.g
+            t, T, E_cur = saved['t'], saved['T'], saved['E_cur']
+            E_best, best_edges = saved['E_best'], saved['best_edges']
+            schedule, stop = saved['schedule'], saved['stop']
+            stop.start(saved['elapsed'])
+            random.setstate(saved['random'])
+            if stats is not None and saved.get('stats') is not None:
+                stats.__dict__.update(saved['stats'].__dict__)
+
+        while t <= max_iter and not stop.done(E_cur):
+            if checkpoint is not None and t > 0 and t % checkpoint_every == 0:
+                save_checkpoint(checkpoint, {
+                    'targets': self.targets, 'N': state.N, 'max_iter': max_iter,
+                    'state': state,
+                    't': t, 'T': T, 'E_cur': E_cur,
+                    'E_best': E_best, 'best_edges': best_edges,
+                    'schedule': schedule, 'stop': stop, 'elapsed': stop.elapsed(),
+                    'random': random.getstate(),
+                    'stats': stats,
+                })
+
+            self.mutate(g, count = 3, state = state) #, local = t/max_iter > random.random())
+            E_new = self.graph_energy(g, state)
+
+            improved = E_new < E_best
+            if improved:
+                E_best = E_new
+                best_edges = state.snapshot()
 
-        E_cur = 1
-        while T > min_t and E_cur > 1e-6:
-            E_cur = self.graph_energy(g)
-            g_new = g.copy()
-            self.mutate(g_new, count = 3) #, local = t/max_iter > random.random())
-            E_new = self.graph_energy(g_new)
-            if (math.exp(-1/T * max(0, E_new - E_cur))) > random.random():
-                g = g_new
+            accepted = (math.exp(-1/T * max(0, E_new - E_cur))) > random.random()
+            if accepted:
+                state.commit()
+                E_cur = E_new
+            else:
+                state.rollback()
 
-            if E_new < E_best:
-                E_best = E_new
-                best_g = g_new.copy()
+            if stats is not None:
+                stats.step(t, T, accepted, E_cur, E_best)
 
-            T = self.update_temperature(T0, t, r)
+            T = schedule.update(t, accepted, improved)
+            stop.update(improved)
             t += 1
 
             if next_print == 0:
@@ -320,8 +874,137 @@ class GraphGenerator():
 
         if self.verbose:
             print("\r\n")
+
+        self.stats = None
+        if best_edges is not None:
+            best_g = igraph.Graph(state.N, best_edges)
         return best_g, self.graph_energy(best_g)
 
+    def metropolis(self, g, T, steps, E_cur = None):
+        """Metropolis chain at constant temperature,
+           single replica of parallel tempering
+
+        Parameters
+        ----------
+        g : igraph.Graph
+            Initial graph, not modified.
+        T : float
+            Temperature.
+        steps : int
+            Number of iterations.
+        E_cur : float
+            Energy of initial graph if already known.
+
+        Returns
+        -------
+        tuple
+            0 - graph at the end of the chain
+            1 - energy of this graph
+            2 - graph with minimum energy visited by the chain
+            3 - energy of this graph
+
+        """
+        state = GraphState(g.copy())
+        if E_cur is None:
+            E_cur = self.graph_energy(state.graph, state)
+
+        E_best = E_cur
+        best_edges = None
+        for _ in range(steps):
+            if E_cur <= 1e-6:
+                break
+
+            self.mutate(state.graph, count = 3, state = state)
+            E_new = self.graph_energy(state.graph, state)
+
+            if E_new < E_best:
+                E_best = E_new
+                best_edges = state.snapshot()
+
+            if (math.exp(-1/T * max(0, E_new - E_cur))) > random.random():
+                state.commit()
+                E_cur = E_new
+            else:
+                state.rollback()
+
+        best_g = igraph.Graph(state.N, best_edges) if best_edges is not None else state.g.copy()
+        return state.g, E_cur, best_g, E_best
+
+    def parallel_tempering(self, g, T0 = 0.03, r = 0.001, max_iter = 100000, replicas = 4, swap_every = 500, processes = None):
+        """Parallel tempering (replica exchange) approach for graph generation.
+           Replicas at different temperatures run in separate processes
+           and neighboring replicas try to exchange their graphs after every
+           swap_every iterations. Can not be launched from a daemonic
+           process, e.g. inside Generate_multicore.
+
+        Parameters
+        ----------
+        g : igraph.Graph
+            Initial graph.
+        T0 : float
+            Highest temperature.
+        r : float
+            Cooling rate, lowest temperature is the final temperature of
+            simulated_annealing with the same parameters.
+        max_iter : int
+            Maximum amount of iterations of each replica.
+        replicas : int
+            Number of replicas, temperatures are spaced geometrically.
+        swap_every : int
+            Iterations between exchange attempts.
+        processes : int
+            Number of processes, one per replica by default.
+
+        Returns
+        -------
+        tuple
+            0 - graph with minimized energy
+            1 - energy of this graph
+
+        """
+        min_t = self.update_temperature(T0, max_iter, r)
+        if replicas > 1:
+            temperatures = [min_t * (T0 / min_t) ** (k / (replicas - 1)) for k in range(replicas)]
+        else:
+            temperatures = [min_t]
+
+        E_start = self.graph_energy(g.copy())
+        graphs = [g] * replicas
+        energies = [E_start] * replicas
+
+        best_g = g
+        E_best = E_start
+
+        pool = multiprocessing.Pool(processes or replicas)
+        t = 0
+        offset = 0
+        while t < max_iter and E_best > 1e-6:
+            steps = min(swap_every, max_iter - t)
+            tasks = [(self, graphs[k], temperatures[k], steps, energies[k], random.getrandbits(64)) for k in range(replicas)]
+            for k, result in enumerate(pool.starmap(Tempering_segment, tasks)):
+                graphs[k], energies[k], replica_best_g, replica_E_best = result
+                if replica_E_best < E_best:
+                    E_best = replica_E_best
+                    best_g = replica_best_g
+            t += steps
+
+            # exchange neighboring replicas, alternating even and odd pairs
+            for k in range(offset, replicas - 1, 2):
+                delta = (1 / temperatures[k] - 1 / temperatures[k + 1]) * (energies[k] - energies[k + 1])
+                if delta >= 0 or math.exp(delta) > random.random():
+                    graphs[k], graphs[k + 1] = graphs[k + 1], graphs[k]
+                    energies[k], energies[k + 1] = energies[k + 1], energies[k]
+            offset = 1 - offset
+
+            if self.verbose:
+                print("Progress: %2.1f%%, energy: %f" % (t/max_iter * 100, E_best), end='\r')
+
+        pool.close()
+        pool.join()
+
+        if self.verbose:
+            print("\r\n")
+        return best_g, self.graph_energy(best_g)
 
     def local_minima(self, g, iter = 2000):
         """ Additional graph generation approach that
@@ -343,30 +1026,62 @@ class GraphGenerator():
         print_step = int(iter / 1000)
         next_print = 0
 
-        best_g = g
+        # tries are mutated in place and rolled back,
+        # the best one is replayed from its journal
+        state = GraphState(g.copy())
         best_e = 1
         for i in range(iter):
-            best_iter_g = None
+            best_iter_journal = []
             best_iter_e = 1
             for _ in range(50):
-                g_new = best_g.copy()
-                self.mutate(g_new, count = 3, local = i/iter > random.random())
-                e = self.graph_energy(g_new)
+                self.mutate(state.graph, count = 3, local = i/iter > random.random(), state = state)
+                e = self.graph_energy(state.graph, state)
                 if (e < best_iter_e):
                     best_iter_e = e
-                    best_iter_g = g_new
+                    best_iter_journal = state.journal
+                state.rollback()
             if best_iter_e < best_e or True:
-                best_g = best_iter_g
+                state.replay(best_iter_journal)
+                state.commit()
                 best_e = best_iter_e
 
             if next_print == 0:
                 next_print = print_step
                 print("Progress: %2.1f%%, energy: %f" % (i/iter * 100, best_e), end='\r')
             next_print -= 1
-        return best_g, best_e
+        return state.g, best_e
+
+
+def Tempering_segment(generator, g, T, steps, E_cur, seed):
+    """Runs a segment of one parallel tempering replica,
+       made for running on its own process
 
+    Parameters
+    ----------
+    generator : GraphGenerator
+        Generator with targets.
+    g : igraph.Graph
+        Graph of the replica.
+    T : float
+        Temperature of the replica.
+    steps : int
+        Number of iterations.
+    E_cur : float
+        Energy of the graph.
+    seed : int
+        Seed for the process' random generator.
+
+    Returns
+    -------
+    tuple
+        Output of GraphGenerator.metropolis
+
+    """
+    random.seed(seed)
+    return generator.metropolis(g, T, steps, E_cur)
 
-def Make_directed(g):
+
+def Make_directed(g, rng = None):
     """As the result of graph generation is undirected
        graph, this function randomly chooses direction of ever edge.
 
@@ -374,6 +1089,8 @@ def Make_directed(g):
     ----------
     g : igraph.Graph
         Undirected graph
+    rng : random.Random
+        Random generator, global random module by default.
 
     Returns
     -------
@@ -385,16 +1102,22 @@ def Make_directed(g):
     g = g.as_directed()
 
     N = g.vcount()
-    edges = [(i, edge) for i, edge in enumerate(g.get_edgelist())]
-    random.shuffle(edges)
-    existing = [[False for _ in range(N)] for _ in range(N)]
-    to_delete = []
-
-    for i, edge in edges:
-        if existing[edge[0]][edge[1]]:
-            to_delete.append(i)
-        else:
-            existing[edge[0]][edge[1]] = existing[edge[1]][edge[0]] = True
+    if kernels.enabled():
+        # shuffling indices gives the same permutation as shuffling edges below
+        order = list(range(g.ecount()))
+        (rng or random).shuffle(order)
+        to_delete = kernels.repeated_edges(g.get_edgelist(), order, N)
+    else:
+        edges = [(i, edge) for i, edge in enumerate(g.get_edgelist())]
+        (rng or random).shuffle(edges)
+        existing = [[False for _ in range(N)] for _ in range(N)]
+        to_delete = []
+
+        for i, edge in edges:
+            if existing[edge[0]][edge[1]]:
+                to_delete.append(i)
+            else:
+                existing[edge[0]][edge[1]] = existing[edge[1]][edge[0]] = True
 
     g.delete_edges(to_delete)
 
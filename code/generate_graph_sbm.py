@@ -7,15 +7,39 @@ Created on Sat Dec  8 17:53:21 2018
 """
 import numpy as np
 import igraph
+from random_graph import sample_pairs, lower_pairs
 
-def GenerateNetworkSBM(sbm, z):
-    # Generate empty network    
+def GenerateNetworkSBM(sbm, z, seed = None):
+    # Generate empty network
+    z = np.asarray(z, dtype=int)
     network = igraph.Graph(n=len(z), directed = True)
+    rng = np.random.default_rng(seed)
 
-    # Draw links randomly according to stochastic block matrix
-    for u in network.vs():
-        for v in network.vs():
-            if (u.index < v.index):
-                if np.random.random() <= sbm[z[u.index], z[v.index]]:
-                    network.add_edge(u, v)
-    return network
\ No newline at end of file
+    # Nodes of every block in increasing order
+    order = np.argsort(z, kind='stable')
+    blocks, starts = np.unique(z[order], return_index=True)
+    members = np.split(order, starts[1:])
+
+    # Draw links of every pair of blocks in bulk, link u -> v (u < v)
+    # exists with probability sbm[z[u], z[v]]
+    sources = [np.zeros(0, dtype=int)]
+    targets = [np.zeros(0, dtype=int)]
+    for r, r_nodes in zip(blocks, members):
+        for s, s_nodes in zip(blocks, members):
+            if r == s:
+                n = len(r_nodes)
+                i, j = lower_pairs(sample_pairs(n * (n - 1) // 2, sbm[r, s], rng))
+                u, v = r_nodes[j], r_nodes[i]
+            else:
+                k = sample_pairs(len(r_nodes) * len(s_nodes), sbm[r, s], rng)
+                u, v = r_nodes[k // len(s_nodes)], s_nodes[k % len(s_nodes)]
+                # pairs with u > v are drawn for blocks (s, r)
+                u, v = u[u < v], v[u < v]
+            sources.append(u)
+            targets.append(v)
+
+    u = np.concatenate(sources)
+    v = np.concatenate(targets)
+    order = np.lexsort((v, u))
+    network.add_edges(list(zip(u[order].tolist(), v[order].tolist())))
+    return network
@@ -5,12 +5,17 @@ import argparse
 import time
 import numpy as np
 from generate_graph import GraphGenerator
+from cooling import StopCriteria
+from distributed import Cluster
+from generation_stats import GenerationStats
+from graph_library import pack_directory
+from progress import imap_progress
 from igraph import Graph
 import os
 from multiprocessing import Process, Pool, cpu_count
 
 
-def Generate_single(fname, N, targets, max_iter = 100000):
+def Generate_single(fname, N, targets, max_iter = 100000, schedule = None, stop = None, checkpoint_every = None, stats = None, resume = False):
     """Generate single graph, made for running on its own process
 
     Parameters
@@ -23,14 +28,40 @@ def Generate_single(fname, N, targets, max_iter = 100000):
         Array of targets for graph to meet.
     max_iter : type
         Maximum number of iterations.
+    schedule : cooling schedule
+        Cooling schedule from cooling module.
+    stop : cooling.StopCriteria
+        Early stopping criteria.
+    checkpoint_every : int
+        Iterations between checkpoints saved next to fname, None to
+        disable.
+    stats : string
+        Format of generation statistics saved as fname + ".stats.<format>",
+        "json" or "csv", None to disable.
+    resume : Boolean
+        Continue existing checkpoint of the same chain.
 
     """
+    checkpoint = fname + ".checkpoint" if checkpoint_every else None
+    collected = GenerationStats() if stats else None
+
     gen = GraphGenerator(targets, verbose = False)
-    [g, energy] = gen.simulated_annealing(Graph(N), max_iter = max_iter)
-    g.write_pickle(fname)
+    [g, energy] = gen.simulated_annealing(Graph(N), max_iter = max_iter, schedule = schedule, stop = stop,
+                                          checkpoint = checkpoint, checkpoint_every = checkpoint_every,
+                                          stats = collected, resume = resume)
+
+    if collected is not None:
+        collected.write("%s.stats.%s" % (fname, stats))
 
+    # graph file appears only when complete
+    g["energy"] = energy
+    g.write_pickle(fname + ".tmp")
+    os.replace(fname + ".tmp", fname)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
 
-def Generate_multicore(sets, N, each_N):
+
+def Generate_multicore(sets, N, each_N, schedule = None, stop = None, resume = False, checkpoint_every = None, library = False, stats = None, cluster = None):
     """Generate multiple graphs using multiple cores
 
     Parameters
@@ -41,6 +72,23 @@ def Generate_multicore(sets, N, each_N):
         Size of each graph.
     each_N : int
         Number of different of graphs for each type.
+    schedule : cooling schedule
+        Cooling schedule passed to Generate_single.
+    stop : cooling.StopCriteria
+        Early stopping criteria passed to Generate_single.
+    resume : Boolean
+        Skip graphs that are already generated and continue chains from
+        their checkpoints.
+    checkpoint_every : int
+        Iterations between checkpoints of each chain, None to disable.
+    library : Boolean
+        Pack graphs of every set into a graph library path + ".glib".
+    stats : string
+        Format of generation statistics of every graph, "json" or "csv",
+        None to disable.
+    cluster : distributed.Cluster
+        Run chains on workers of a work queue server instead of local
+        cores, paths must be on a filesystem shared with them.
 
     """
     start_time = time.time()
@@ -53,23 +101,30 @@ def Generate_multicore(sets, N, each_N):
         [path, targets] = sets[i]
         os.makedirs(path, exist_ok = True)
         for j in range(each_N):
-            fname = "%s/%i.graph" % (path, j)
-            graphs.append((fname, N, targets))
-
-    pool = Pool()
-    rs = pool.starmap_async(Generate_single, graphs)
-
-    pool.close()
-    while (True):
-      if (rs.ready()): break
-      remaining = rs._number_left
-      print("Waiting for %i tasks to complete..." % (remaining), end="\r")
-      time.sleep(30)
+            fname = os.path.abspath("%s/%i.graph" % (path, j))
+            if resume and os.path.exists(fname):
+                continue
+            graphs.append((fname, N, targets, 100000, schedule, stop, checkpoint_every, stats, resume))
+
+    if resume:
+        print("%i graphs left to generate" % len(graphs))
+
+    if cluster is not None:
+        for _ in cluster.imap(Generate_single, graphs, "graphs", star = True):
+            pass
+    else:
+        with Pool() as pool:
+            for _ in imap_progress(pool, Generate_single, graphs, "graphs", star = True):
+                pass
+
+    if library:
+        for path, targets in sets:
+            print("Packed %s" % pack_directory(path, targets = targets))
 
     print("\r\nDone, took %i seconds" % (time.time() - start_time))
 
 
-def Generate_clustering(N, d, cluster_N, each_N, base_path):
+def Generate_clustering(N, d, cluster_N, each_N, base_path, stop = None, resume = False, checkpoint_every = None, library = False, stats = None, cluster = None):
     """Generate graphs with different clustering coefficients
 
     Parameters
@@ -84,6 +139,18 @@ def Generate_clustering(N, d, cluster_N, each_N, base_path):
         Number of graphs per clustering coefficient.
     base_path : string
         Directory to store graphs.
+    stop : cooling.StopCriteria
+        Early stopping criteria.
+    resume : Boolean
+        Skip graphs that are already generated.
+    checkpoint_every : int
+        Iterations between checkpoints of each chain, None to disable.
+    library : Boolean
+        Pack graphs of every set into a graph library.
+    stats : string
+        Format of generation statistics of every graph, None to disable.
+    cluster : distributed.Cluster
+        Run chains on workers of a work queue server, see Generate_multicore.
 
     """
     sets = []
@@ -98,10 +165,10 @@ def Generate_clustering(N, d, cluster_N, each_N, base_path):
         ]
         sets.append((path, targets))
 
-    Generate_multicore(sets, N, each_N)
+    Generate_multicore(sets, N, each_N, stop = stop, resume = resume, checkpoint_every = checkpoint_every, library = library, stats = stats, cluster = cluster)
 
 
-def Generate_communities(N, d, max_communities, each_N, base_path):
+def Generate_communities(N, d, max_communities, each_N, base_path, stop = None, resume = False, checkpoint_every = None, library = False, stats = None, cluster = None):
     """Generate graphs with different number of communities
 
     Parameters
@@ -116,6 +183,18 @@ def Generate_communities(N, d, max_communities, each_N, base_path):
         Number of graphs per clustering coefficient.
     base_path : string
         Directory to store graphs.
+    stop : cooling.StopCriteria
+        Early stopping criteria.
+    resume : Boolean
+        Skip graphs that are already generated.
+    checkpoint_every : int
+        Iterations between checkpoints of each chain, None to disable.
+    library : Boolean
+        Pack graphs of every set into a graph library.
+    stats : string
+        Format of generation statistics of every graph, None to disable.
+    cluster : distributed.Cluster
+        Run chains on workers of a work queue server, see Generate_multicore.
 
     """
     sets = []
@@ -129,7 +208,7 @@ def Generate_communities(N, d, max_communities, each_N, base_path):
         ]
         sets.append((path, targets))
 
-    Generate_multicore(sets, N, each_N)
+    Generate_multicore(sets, N, each_N, stop = stop, resume = resume, checkpoint_every = checkpoint_every, library = library, stats = stats, cluster = cluster)
 
 
 if __name__ == "__main__":
@@ -147,13 +226,41 @@ if __name__ == "__main__":
                         action='store_true',
                         help='Generate graphs for different clustering coefficients [light version]')
 
+    parser.add_argument('--patience', dest='patience', type=int, default=None,
+                        help='Stop a chain after this many iterations without improvement')
+
+    parser.add_argument('--time-budget', dest='timeBudget', type=float, default=None,
+                        help='Stop a chain after this many seconds')
+
+    parser.add_argument('--resume', dest='resume',
+                        action='store_true',
+                        help='Skip generated graphs and continue interrupted chains')
+
+    parser.add_argument('--checkpoint-every', dest='checkpointEvery', type=int, default=10000,
+                        help='Iterations between checkpoints of each chain, 0 to disable')
+
+    parser.add_argument('--library', dest='library',
+                        action='store_true',
+                        help='Also pack graphs of every set into a single graph library file')
+
+    parser.add_argument('--stats', dest='stats', choices=['json', 'csv'], default=None,
+                        help='Save evaluation and mutation times, acceptance rates and energy trajectory of every graph')
+
+    parser.add_argument('--cluster', dest='cluster', default=None,
+                        help='Run chains on workers of a work queue server at host:port, see distributed.py')
+
     args = parser.parse_args()
 
+    stop = StopCriteria(patience = args.patience, time_budget = args.timeBudget)
+    options = {'stop': stop, 'resume': args.resume, 'checkpoint_every': args.checkpointEvery or None,
+               'library': args.library, 'stats': args.stats,
+               'cluster': Cluster(args.cluster) if args.cluster else None}
+
     if args.communities:
-        Generate_communities(25, 0.2, 5, 100, "pregenerated_graphs/communities/communities")
+        Generate_communities(25, 0.2, 5, 100, "pregenerated_graphs/communities/communities", **options)
 
     if args.clustering:
-        Generate_clustering(25, 0.2, 100, 100, "pregenerated_graphs/clustering_lite/clustering")
+        Generate_clustering(25, 0.2, 100, 100, "pregenerated_graphs/clustering_lite/clustering", **options)
 
     if args.clusteringLight:
-        Generate_clustering(25, 0.2, 50, 20, "pregenerated_graphs/clustering_lite/clustering")
+        Generate_clustering(25, 0.2, 50, 20, "pregenerated_graphs/clustering_lite/clustering", **options)
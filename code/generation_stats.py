@@ -0,0 +1,131 @@
+"""
+    Statistics of graph generation
+
+    Collected by GraphGenerator when given a GenerationStats: time spent
+    evaluating every target, time spent in every mutation type,
+    acceptance rate per temperature band and the energy trajectory.
+"""
+import csv
+import json
+import math
+
+
+class GenerationStats():
+    """Statistics of a single annealing run
+
+    Parameters
+    ----------
+    every : int
+        Iterations between points of the energy trajectory.
+    bands : int
+        Temperature bands per decade.
+
+    Attributes
+    ----------
+    eval_time : dict
+        Target -> [evaluations, seconds].
+    move_time : dict
+        Mutation type (0-4) -> [mutations, seconds].
+    acceptance : dict
+        Lower temperature of band -> [proposed, accepted].
+    trajectory : array
+        Array of [iteration, temperature, current energy, best energy].
+    cache : array
+        Energy cache [hits, misses].
+
+    """
+    def __init__(self, every = 100, bands = 4):
+        self.every = every
+        self.bands = bands
+        self.eval_time = {}
+        self.move_time = {}
+        self.acceptance = {}
+        self.trajectory = []
+        self.cache = [0, 0]
+        self.iterations = 0
+
+    def time_eval(self, target, seconds):
+        """Records evaluation of a target"""
+        entry = self.eval_time.setdefault(target, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def time_move(self, s, seconds):
+        """Records a mutation of type s"""
+        entry = self.move_time.setdefault(s, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def cache_lookup(self, hit):
+        """Records a lookup of the energy cache"""
+        self.cache[0 if hit else 1] += 1
+
+    def step(self, t, T, accepted, E_cur, E_best):
+        """Records an iteration of annealing
+
+        Parameters
+        ----------
+        t : int
+            Iteration.
+        T : float
+            Temperature the candidate was judged at.
+        accepted : Boolean
+            Whether candidate was accepted.
+        E_cur : float
+            Energy of current graph after the iteration.
+        E_best : float
+            Lowest energy so far.
+
+        """
+        band = 10 ** (math.floor(math.log10(T) * self.bands) / self.bands) if T > 0 else 0
+        entry = self.acceptance.setdefault(band, [0, 0])
+        entry[0] += 1
+        entry[1] += accepted
+
+        if t % self.every == 0:
+            self.trajectory.append([t, T, E_cur, E_best])
+        self.iterations += 1
+
+    def to_dict(self):
+        """Statistics as JSON serializable dict"""
+        return {
+            'iterations': self.iterations,
+            'eval_time': {str(k): {'count': v[0], 'seconds': v[1]} for k, v in self.eval_time.items()},
+            'move_time': {str(k): {'count': v[0], 'seconds': v[1]} for k, v in sorted(self.move_time.items())},
+            'acceptance': [{'T': band, 'proposed': v[0], 'accepted': v[1], 'rate': v[1] / v[0]}
+                           for band, v in sorted(self.acceptance.items(), reverse=True)],
+            'cache': {'hits': self.cache[0], 'misses': self.cache[1]},
+            'trajectory': self.trajectory,
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def write_csv(self, path):
+        """Writes statistics as rows (section, key, field, value)"""
+        data = self.to_dict()
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(['section', 'key', 'field', 'value'])
+            writer.writerow(['iterations', '', 'count', data['iterations']])
+            for section in ['eval_time', 'move_time']:
+                for key, entry in data[section].items():
+                    for field, value in entry.items():
+                        writer.writerow([section, key, field, value])
+            for entry in data['acceptance']:
+                for field in ['proposed', 'accepted', 'rate']:
+                    writer.writerow(['acceptance', entry['T'], field, entry[field]])
+            for field, value in data['cache'].items():
+                writer.writerow(['cache', '', field, value])
+            for t, T, E_cur, E_best in data['trajectory']:
+                writer.writerow(['trajectory', t, 'T', T])
+                writer.writerow(['trajectory', t, 'E_cur', E_cur])
+                writer.writerow(['trajectory', t, 'E_best', E_best])
+
+    def write(self, path):
+        """Writes statistics as CSV if path ends with .csv, as JSON otherwise"""
+        if path.endswith(".csv"):
+            self.write_csv(path)
+        else:
+            self.write_json(path)
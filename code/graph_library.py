@@ -0,0 +1,204 @@
+"""
+    Packed graph library, all graphs of an ensemble in a single file
+
+    File layout:
+        magic "GLIB0001", uint64 header length, JSON header,
+        then arrays aligned to 64 bytes:
+            offsets  - int64, first edge of every graph (count + 1)
+            vcounts  - int64, number of vertices of every graph
+            energies - float64, achieved energy of every graph
+            edges    - int32, concatenated edge lists (E x 2)
+    Arrays are read as views of one memory map, without copying.
+"""
+import argparse
+import json
+import os
+import re
+import numpy as np
+from igraph import Graph
+
+MAGIC = b"GLIB0001"
+ALIGN = 64
+
+
+def write_library(path, graphs, targets = None, energies = None, names = None):
+    """Write graphs into a single library file
+
+    Parameters
+    ----------
+    path : string
+        Library file.
+    graphs : array
+        Array of igraph.Graph.
+    targets : array
+        Generation targets of the ensemble.
+    energies : array
+        Achieved energy of every graph, NaN if unknown.
+    names : array
+        Name of every graph, e.g. file it was packed from.
+
+    """
+    count = len(graphs)
+    edge_lists = [np.array(g.get_edgelist(), dtype=np.int32).reshape(-1, 2) for g in graphs]
+
+    arrays = [
+        ('offsets', np.cumsum([0] + [len(e) for e in edge_lists], dtype=np.int64)),
+        ('vcounts', np.array([g.vcount() for g in graphs], dtype=np.int64)),
+        ('energies', np.array(energies if energies is not None else [np.nan] * count, dtype=np.float64)),
+        ('edges', np.concatenate(edge_lists) if count > 0 else np.zeros((0, 2), dtype=np.int32)),
+    ]
+
+    header = {
+        'count': count,
+        'directed': bool(count > 0 and graphs[0].is_directed()),
+        'targets': targets,
+        'names': names,
+        'arrays': {},
+    }
+
+    # header length depends on array positions, so space reserved
+    # for the header grows until it fits
+    reserved = len(MAGIC) + 8 + len(json.dumps(header).encode()) + 256
+    while True:
+        position = reserved
+        for name, array in arrays:
+            position = -(-position // ALIGN) * ALIGN
+            header['arrays'][name] = [position, array.dtype.str, list(array.shape)]
+            position += array.nbytes
+        encoded = json.dumps(header).encode()
+        if len(MAGIC) + 8 + len(encoded) <= reserved:
+            break
+        reserved *= 2
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(encoded)).tobytes())
+        f.write(encoded)
+        for name, array in arrays:
+            f.seek(header['arrays'][name][0])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(path + ".tmp", path)
+
+
+class GraphLibrary():
+    """Zero-copy reader of a library written with write_library
+
+    Parameters
+    ----------
+    path : string
+        Library file.
+
+    Attributes
+    ----------
+    offsets : array
+        First edge of every graph.
+    vcounts : array
+        Number of vertices of every graph.
+    energies : array
+        Achieved energy of every graph.
+    edges_all : array
+        Concatenated edge lists.
+    targets : array
+        Generation targets of the ensemble.
+    names : array
+        Names of graphs or None.
+    directed : Boolean
+    path
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise ValueError('"%s" is not a graph library' % (path))
+
+        length = int(np.frombuffer(self.data, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(self.data[start:start + length]).decode())
+
+        self.targets = header['targets']
+        self.names = header['names']
+        self.directed = header['directed']
+
+        def array(name):
+            offset, dtype, shape = header['arrays'][name]
+            count = int(np.prod(shape))
+            if count == 0:
+                return np.zeros(shape, dtype=dtype)
+            return np.frombuffer(self.data, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+        self.offsets = array('offsets')
+        self.vcounts = array('vcounts')
+        self.energies = array('energies')
+        self.edges_all = array('edges')
+
+    def __len__(self):
+        return len(self.vcounts)
+
+    def edges(self, k):
+        """Edge list of graph k as a view into the library"""
+        return self.edges_all[self.offsets[k]:self.offsets[k + 1]]
+
+    def graph(self, k):
+        """Graph k as igraph.Graph"""
+        edges = self.edges(k)
+        return Graph(int(self.vcounts[k]), list(zip(edges[:, 0].tolist(), edges[:, 1].tolist())), directed = self.directed)
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.graph(k)
+
+
+def pack_directory(dirpath, path = None, targets = None):
+    """Pack all pickled graphs (*.graph) of a directory into a library
+
+    Parameters
+    ----------
+    dirpath : string
+        Directory with pickled graphs.
+    path : string
+        Library file, dirpath + ".glib" by default.
+    targets : array
+        Generation targets of the graphs.
+
+    Returns
+    -------
+    string
+        Library file or None if there were no graphs.
+
+    """
+    if path is None:
+        path = dirpath.rstrip("/\\") + ".glib"
+
+    def number(filename):
+        digits = re.findall(r"\d+", filename)
+        return (int(digits[0]) if digits else -1, filename)
+
+    filenames = sorted([f for f in os.listdir(dirpath) if f.endswith(".graph")], key=number)
+    if len(filenames) < 1:
+        return None
+
+    graphs = []
+    energies = []
+    for filename in filenames:
+        g = Graph.Read_Pickle(os.path.join(dirpath, filename))
+        graphs.append(g)
+        energies.append(g["energy"] if "energy" in g.attributes() else np.nan)
+
+    write_library(path, graphs, targets, energies, filenames)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pack pickled graphs into graph libraries')
+
+    parser.add_argument('paths', nargs='+',
+                        help='Directories searched for *.graph files, every directory with graphs becomes one library')
+
+    args = parser.parse_args()
+
+    for base_path in args.paths:
+        for dirpath, dirnames, filenames in os.walk(base_path):
+            library = pack_directory(dirpath)
+            if library is not None:
+                print("Packed %s" % library)
@@ -0,0 +1,212 @@
+"""
+    Compiled kernels of default dynamics and graph directing
+
+    Kernels are compiled with numba when it is installed and give the
+    same results as the NumPy code paths they replace. Backend is chosen
+    at import time from environment variable NIER_BACKEND ("numba" or
+    "numpy"), numba when available by default, and can be changed with
+    set_backend. With backend "numpy" callers keep their original code.
+"""
+import itertools
+import os
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # compiled kernels are optional
+    numba = None
+
+BACKENDS = ["numba", "numpy"]
+
+
+def cascade_kernel(c, b, i_full, shock, eps):
+    """Loop of simulate on copies of its state, see simulate"""
+    N = c.size
+    while np.max(shock) > eps and np.max(c) > eps:
+        for s_i in range(N):
+            s_shock = shock[s_i]
+            if s_shock > eps:
+                not_absorbed = max(0.0, s_shock - c[s_i])
+                c[s_i] = max(0.0, c[s_i] - s_shock)
+                shock[s_i] = 0
+
+                not_absorbed = min(not_absorbed, b[s_i])
+                if not_absorbed > 0:
+                    b[s_i] -= not_absorbed
+
+                    borrowed = 0.0
+                    for j in range(N):
+                        borrowed += i_full[j, s_i]
+                    for j in range(N):
+                        loss = i_full[j, s_i] * not_absorbed / borrowed
+                        i_full[j, s_i] -= loss
+                        shock[j] += loss
+
+            shock[s_i] = 0
+
+    defaults = 0
+    for s_i in range(N):
+        if c[s_i] < eps:
+            defaults += 1
+    return defaults
+
+
+def cascade_rows_kernel(c, b, shock, col_ptr, col_idx, col_val, borrowed, eps):
+    """Loop of simulate_all, row by row, on copies of its state, see simulate_all"""
+    K, N = c.shape
+    defaults = np.zeros(K, dtype=np.int64)
+    for k in range(K):
+        while np.max(shock[k]) > eps and np.max(c[k]) > eps:
+            for s_i in range(N):
+                s_shock = shock[k, s_i]
+                if s_shock > eps:
+                    not_absorbed = max(0.0, s_shock - c[k, s_i])
+                    c[k, s_i] = max(0.0, c[k, s_i] - s_shock)
+
+                    not_absorbed = min(not_absorbed, b[k, s_i])
+                    if not_absorbed > 0:
+                        b[k, s_i] -= not_absorbed
+                        share = not_absorbed / borrowed[s_i]
+                        for p in range(col_ptr[s_i], col_ptr[s_i + 1]):
+                            shock[k, col_idx[p]] += share * col_val[p]
+
+                shock[k, s_i] = 0
+
+        for s_i in range(N):
+            if c[k, s_i] < eps:
+                defaults[k] += 1
+    return defaults
+
+
+def repeated_pairs_kernel(sources, targets, N):
+    """Loop of Make_directed, marks edges whose pair was already seen"""
+    existing = np.zeros((N, N), dtype=np.bool_)
+    repeated = np.zeros(sources.size, dtype=np.bool_)
+    for k in range(sources.size):
+        u = sources[k]
+        v = targets[k]
+        if existing[u, v]:
+            repeated[k] = True
+        else:
+            existing[u, v] = True
+            existing[v, u] = True
+    return repeated
+
+
+if numba is not None:
+    # error_model numpy: division by zero gives inf/nan as in NumPy
+    jit = numba.njit(cache = True, error_model = 'numpy')
+    cascade_kernel = jit(cascade_kernel)
+    cascade_rows_kernel = jit(cascade_rows_kernel)
+    repeated_pairs_kernel = jit(repeated_pairs_kernel)
+
+backend = None
+
+
+def set_backend(name = None):
+    """Selects backend
+
+    Parameters
+    ----------
+    name : string
+        "numba" or "numpy", numba when available by default.
+
+    """
+    global backend
+    if name is None:
+        name = "numba" if numba is not None else "numpy"
+    if name not in BACKENDS:
+        raise ValueError('Unknown backend "%s", choose one of %s' % (name, BACKENDS))
+    if name == "numba" and numba is None:
+        raise ImportError("Backend numba requires numba")
+    backend = name
+
+
+def enabled():
+    """Whether compiled kernels are used"""
+    return backend == "numba"
+
+
+def cascade(a, c, b, i_full, shock_size, shock_bank, eps = 1):
+    """Number of defaults of a single cascade, same as simulate
+
+    Parameters
+    ----------
+    a, c, b : array
+        Assets, net worths and interbank borrowing, output of apply.
+    i_full : array
+        Dense exposure matrix, output of apply.
+    shock_size : float
+        Initial shock size.
+    shock_bank : int
+        Bank where initial shock is applied.
+    eps : float
+        Smallest amount considered.
+
+    Returns
+    -------
+    int
+        Number of defaults.
+
+    """
+    c = np.array(c, dtype=float)
+    b = np.array(b, dtype=float)
+    i_full = np.array(i_full, dtype=float)
+    shock = np.zeros(c.size)
+    shock[shock_bank] = min(shock_size, a[shock_bank])
+    return int(cascade_kernel(c, b, i_full, shock, float(eps)))
+
+
+def cascade_rows(c, b, shock, columns, borrowed, eps = 1):
+    """Number of defaults of every row of simulate_all state, same as simulate_all
+
+    Parameters
+    ----------
+    c, b, shock : array
+        Net worths, interbank borrowing and shocks (origin x bank).
+    columns : array
+        Creditors and exposures of every bank, see exposures.
+    borrowed : array
+        Total interbank borrowing of every bank.
+    eps : float
+        Smallest amount considered.
+
+    Returns
+    -------
+    array
+        Number of defaults for each row.
+
+    """
+    col_ptr = np.cumsum([0] + [len(creditors) for creditors, _ in columns]).astype(np.int64)
+    col_idx = np.concatenate([np.asarray(creditors, dtype=np.int64) for creditors, _ in columns] + [np.zeros(0, dtype=np.int64)])
+    col_val = np.concatenate([np.asarray(values, dtype=float) for _, values in columns] + [np.zeros(0)])
+    return cascade_rows_kernel(np.array(c, dtype=float, order='C'), np.array(b, dtype=float, order='C'),
+                               np.array(shock, dtype=float, order='C'), col_ptr, col_idx, col_val,
+                               np.asarray(borrowed, dtype=float), float(eps))
+
+
+def repeated_edges(edges, order, N):
+    """Edges of Make_directed to delete, whose unordered pair appeared
+       earlier in the given order
+
+    Parameters
+    ----------
+    edges : array
+        Array of (source, target) tuples.
+    order : array
+        Order in which edges are visited.
+    N : int
+        Number of nodes.
+
+    Returns
+    -------
+    array
+        Indices of edges.
+
+    """
+    order = np.array(order, dtype=np.int64)
+    edges = np.fromiter(itertools.chain.from_iterable(edges), dtype=np.int64, count=2 * order.size).reshape(-1, 2)[order]
+    return order[repeated_pairs_kernel(edges[:, 0].copy(), edges[:, 1].copy(), N)].tolist()
+
+
+set_backend(os.environ.get("NIER_BACKEND"))
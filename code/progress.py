@@ -0,0 +1,167 @@
+"""
+    Progress of tasks running on a multiprocessing pool
+
+    Results are consumed with imap_unordered as they complete, so callers
+    return as soon as the last task is done. Progress line shows done
+    tasks, tasks per second, ETA and utilization of worker processes.
+"""
+import os
+import time
+
+
+def format_seconds(seconds):
+    """Seconds as h:mm:ss"""
+    seconds = int(round(seconds))
+    return "%i:%02i:%02i" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Progress():
+    """Throughput, ETA and worker utilization of a batch of tasks
+
+    Parameters
+    ----------
+    total : int
+        Number of tasks.
+    label : string
+        Name of tasks in printed lines.
+    workers : int
+        Number of worker processes.
+    interval : float
+        Seconds between printed lines.
+
+    """
+    def __init__(self, total, label = "tasks", workers = None, interval = 0.5):
+        self.total = total
+        self.label = label
+        self.workers = workers or os.cpu_count()
+        self.interval = interval
+        self.done = 0
+        self.busy = {}
+        self.start = time.perf_counter()
+        self.printed = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def rate(self):
+        """Completed tasks per second"""
+        return self.done / max(self.elapsed(), 1e-9)
+
+    def eta(self):
+        """Seconds until all tasks are done at current rate, None before first task"""
+        if self.done == 0:
+            return None
+        return (self.total - self.done) / self.rate()
+
+    def utilization(self):
+        """Fraction of time workers spent on tasks
+
+        Returns
+        -------
+        tuple
+            0 - mean over all workers
+            1 - lowest of workers that reported
+            2 - highest of workers that reported
+
+        """
+        elapsed = max(self.elapsed(), 1e-9)
+        if len(self.busy) == 0:
+            return 0, 0, 0
+        busy = [b / elapsed for b in self.busy.values()]
+        return sum(self.busy.values()) / (elapsed * self.workers), min(busy), max(busy)
+
+    def update(self, count = 1, worker = None, busy = 0):
+        """Records completed tasks
+
+        Parameters
+        ----------
+        count : int
+            Number of completed tasks.
+        worker : int
+            Process id of the worker that ran them.
+        busy : float
+            Seconds the worker spent on them.
+
+        """
+        self.done += count
+        if worker is not None:
+            self.busy[worker] = self.busy.get(worker, 0) + busy
+
+        now = time.perf_counter()
+        if now - self.printed >= self.interval or self.done >= self.total:
+            self.printed = now
+            print(self.line(), end="\r")
+
+    def line(self):
+        eta = self.eta()
+        mean, low, high = self.utilization()
+        return "%i/%i %s, %.2f %s/s, ETA %s, workers busy %.0f%% (%.0f-%.0f%%)    " % (
+            self.done, self.total, self.label, self.rate(), self.label,
+            format_seconds(eta) if eta is not None else "-", mean * 100, low * 100, high * 100)
+
+    def finish(self):
+        """Prints summary of the batch"""
+        mean, low, high = self.utilization()
+        print("\r\nDone %i %s in %s, %.2f %s/s, workers busy %.0f%% (%.0f-%.0f%%)" % (
+            self.done, self.label, format_seconds(self.elapsed()), self.rate(), self.label,
+            mean * 100, low * 100, high * 100))
+
+
+class Timed():
+    """Picklable wrapper of a task function that also returns
+       process id of the worker and seconds spent on the task
+
+    Parameters
+    ----------
+    fn : function
+        Module level task function.
+    star : Boolean
+        Whether tasks are tuples of arguments, as in starmap.
+
+    """
+    def __init__(self, fn, star = False):
+        self.fn = fn
+        self.star = star
+
+    def __call__(self, task):
+        start = time.perf_counter()
+        result = self.fn(*task) if self.star else self.fn(task)
+        return result, os.getpid(), time.perf_counter() - start
+
+
+def imap_progress(pool, fn, tasks, label = "tasks", chunksize = 1, star = False, size = None, total = None, workers = None):
+    """Runs tasks on a pool and yields results as they complete, printing progress
+
+    Parameters
+    ----------
+    pool : multiprocessing.Pool
+        Pool to run tasks on.
+    fn : function
+        Module level task function.
+    tasks : array
+        Arguments of tasks.
+    label : string
+        Name of counted units in printed lines.
+    chunksize : int
+        Tasks sent to a worker at once.
+    star : Boolean
+        Whether tasks are tuples of arguments, as in starmap.
+    size : function
+        Number of counted units in a result, 1 by default.
+    total : int
+        Total number of counted units, number of tasks by default.
+    workers : int
+        Number of worker processes of pool.
+
+    Returns
+    -------
+    generator
+        Results in order of completion.
+
+    """
+    tasks = list(tasks)
+    progress = Progress(total if total is not None else len(tasks), label, workers)
+    for result, worker, busy in pool.imap_unordered(Timed(fn, star), tasks, chunksize):
+        progress.update(size(result) if size is not None else 1, worker, busy)
+        yield result
+    progress.finish()
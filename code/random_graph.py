@@ -1,7 +1,62 @@
 from igraph import Graph
-from random import random as rand
+import numpy as np
 
-def Directed(n, p):
+def sample_pairs(count, p, rng):
+    """Choose each of count pairs independently with probability p
+
+    Number of chosen pairs is drawn from binomial distribution and then
+    that many distinct pairs are drawn uniformly, which has the same
+    distribution as a Bernoulli trial per pair, but the cost scales with
+    number of chosen pairs for sparse p.
+
+    Parameters
+    ----------
+    count : int
+        Number of pairs.
+    p : float
+        Probability that a pair is chosen.
+    rng : numpy.random.Generator
+        Random generator to use.
+
+    Returns
+    -------
+    array
+        Sorted indices of chosen pairs.
+
+    """
+    if count <= 0 or p <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    m = rng.binomial(count, min(p, 1))
+    chosen = rng.choice(count, m, replace=False)
+    chosen.sort()
+    return chosen.astype(np.int64)
+
+def lower_pairs(k):
+    """Map indices of pairs (i, j), j < i, ordered by i and then j
+       to the pairs themselves
+
+    Parameters
+    ----------
+    k : array
+        Indices of pairs, k = i * (i - 1) / 2 + j.
+
+    Returns
+    -------
+    tuple
+        0 - array of i
+        1 - array of j
+
+    """
+    k = np.asarray(k, dtype=np.int64)
+    i = ((1 + np.sqrt(1 + 8 * k.astype(float))) // 2).astype(np.int64)
+    # correct rounding of square root for large k
+    i -= i * (i - 1) // 2 > k
+    i += (i + 1) * i // 2 <= k
+    j = k - i * (i - 1) // 2
+    return i, j
+
+def Directed(n, p, seed = None):
     """Generate directed graph
 
     Parameters
@@ -10,6 +65,8 @@ def Directed(n, p):
         Number of nodes
     p : float
         Probability that 2 nodes are connected.
+    seed : int or numpy.random.Generator
+        Seed or random generator, fresh entropy by default.
 
     Returns
     -------
@@ -17,17 +74,15 @@ def Directed(n, p):
         Generated graph.
 
     """
+    rng = np.random.default_rng(seed)
+    i, j = lower_pairs(sample_pairs(n * (n - 1) // 2, p, rng))
+    forward = rng.random(i.size) > 0.5
+
     g = Graph(n, directed = True)
-    for i in range(n):
-        for j in range(i):
-            if rand() < p:
-                if rand() > 0.5:
-                    g.add_edge(i, j)
-                else:
-                    g.add_edge(j, i)
+    g.add_edges(list(zip(np.where(forward, i, j).tolist(), np.where(forward, j, i).tolist())))
     return g
 
-def Directed2(n, p):
+def Directed2(n, p, seed = None):
     """Generate directed graph
 
     Parameters
@@ -36,6 +91,8 @@ def Directed2(n, p):
         Number of nodes
     p : float
         Probability that 2 nodes are connected.
+    seed : int or numpy.random.Generator
+        Seed or random generator, fresh entropy by default.
 
     Returns
     -------
@@ -43,14 +100,18 @@ def Directed2(n, p):
         Generated graph.
 
     """
+    rng = np.random.default_rng(seed)
+    k = sample_pairs(n * (n - 1), p, rng)
+    # ordered pairs without loops, row i skips column i
+    i = k // max(n - 1, 1)
+    j = k % max(n - 1, 1)
+    j += j >= i
+
     g = Graph(n, directed = True)
-    for i in range(n):
-        for j in range(n):
-            if i != j and rand() < p:
-                g.add_edge(i, j)
+    g.add_edges(list(zip(i.tolist(), j.tolist())))
     return g
 
-def Undirected(n, p):
+def Undirected(n, p, seed = None):
     """Generate undirected graph
 
     Parameters
@@ -59,6 +120,8 @@ def Undirected(n, p):
         Number of nodes
     p : float
         Probability that 2 nodes are connected.
+    seed : int or numpy.random.Generator
+        Seed or random generator, fresh entropy by default.
 
     Returns
     -------
@@ -66,9 +129,9 @@ def Undirected(n, p):
         Generated graph.
 
     """
+    rng = np.random.default_rng(seed)
+    i, j = lower_pairs(sample_pairs(n * (n - 1) // 2, p, rng))
+
     g = Graph(n)
-    for i in range(n):
-        for j in range(i):
-            if rand() < p:
-                g.add_edge(j, i)
+    g.add_edges(list(zip(j.tolist(), i.tolist())))
     return g
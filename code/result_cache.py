@@ -0,0 +1,135 @@
+"""
+    Persistent store of simulation results, keyed by parameters
+
+    Results live in a SQLite file, so that reruns and extended sweeps
+    only simulate points that are missing. Keys are JSON encoded lists
+    of everything the result depends on, values are JSON.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+
+def make_key(*parts):
+    """Encodes parts of a key, numpy scalars are stored as Python numbers
+
+    Parameters
+    ----------
+    parts : array
+        JSON serializable values.
+
+    Returns
+    -------
+    string
+        Key.
+
+    """
+    return json.dumps(parts, default=lambda x: x.item())
+
+
+def file_identity(path):
+    """Identity of a graph file, changes when the file is rewritten
+
+    Parameters
+    ----------
+    path : string
+        File, e.g. pickled graph or graph library.
+
+    Returns
+    -------
+    array
+        Absolute path, size and modification time.
+
+    """
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def code_digest(code):
+    """Hash of bytecode and constants, stable across runs"""
+    digest = hashlib.sha1(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            digest.update(code_digest(const).encode())
+        else:
+            digest.update(repr(const).encode())
+    return digest.hexdigest()[:16]
+
+
+def function_name(fn):
+    """Name and code hash that identify a module level function across runs
+
+    Lambdas and nested functions are rejected, as different ones share
+    the same name.
+
+    Raises
+    ------
+    ValueError
+        If fn is not a module level function.
+
+    """
+    if "<" in fn.__qualname__:
+        raise ValueError("Cached results need a module level function, got %s" % fn.__qualname__)
+    code = getattr(fn, "__code__", None)
+    name = "%s.%s" % (fn.__module__, fn.__qualname__)
+    return name if code is None else "%s:%s" % (name, code_digest(code))
+
+
+class ResultCache():
+    """Key value store of results in a SQLite file
+
+    Parameters
+    ----------
+    path : string
+        Database file, created if missing.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+    def get_many(self, keys):
+        """Looks up results
+
+        Parameters
+        ----------
+        keys : array
+            Keys made with make_key.
+
+        Returns
+        -------
+        dict
+            Stored results of keys that were found.
+
+        """
+        found = {}
+        keys = list(keys)
+        # stay below SQLite limit of bound variables
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            rows = self.db.execute("SELECT key, value FROM results WHERE key IN (%s)" % ",".join("?" * len(part)), part)
+            for key, value in rows:
+                found[key] = json.loads(value)
+        return found
+
+    def put_many(self, items):
+        """Stores results
+
+        Parameters
+        ----------
+        items : array
+            Array of (key, result) tuples.
+
+        """
+        self.db.executemany("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)",
+                            [(key, json.dumps(value, default=lambda x: x.item())) for key, value in items])
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.db.close()
@@ -7,20 +7,103 @@
 
 """
 
+import atexit
 import numpy as np
 import random
-import time
+import heapq
 import multiprocessing
 import matplotlib.pyplot as plt
 import random_graph
+import kernels
+from result_cache import make_key
+from progress import imap_progress
+
+try:
+    import scipy.sparse
+except ImportError:  # sparse exposures are optional
+    scipy = None
+
+def is_sparse(m):
+    """Whether exposure matrix is a scipy sparse matrix"""
+    return scipy is not None and scipy.sparse.issparse(m)
+
+
+def exposures(g, i_full, bank):
+    """Creditors of a bank and their exposures to it
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Directed graph used for simulation.
+    i_full : array or scipy.sparse.csc_matrix
+        Exposure matrix, output of apply method.
+    bank : int
+        Borrowing bank.
+
+    Returns
+    -------
+    tuple
+        0 - sorted indices of creditors
+        1 - nonzero entries of the bank's column in i_full
+
+    """
+    if is_sparse(i_full):
+        start, end = i_full.indptr[bank], i_full.indptr[bank + 1]
+        return i_full.indices[start:end], i_full.data[start:end]
+
+    creditors = np.unique(np.array(g.predecessors(bank), dtype=int))
+    return creditors, i_full[creditors, bank]
 
-def apply(g, E, gamma, theta):
-    """ Generating weights for given topology
+
+def topology(g, sparse = False):
+    """Parts of weights that depend only on the graph
 
     Parameters
     ----------
     g : igraph.Graph
         Given graph.
+    sparse : Boolean
+        Whether to build the adjacency as scipy.sparse.csc_matrix from the
+        edge list, so that memory scales with edges instead of N^2.
+
+    Returns
+    -------
+    tuple
+        0 - NxN adjacency matrix, counting parallel edges
+        1 - number of links lent by every bank
+        2 - number of links borrowed by every bank
+        3 - number of links
+
+    """
+    N = g.vcount()
+    Z = g.ecount()
+
+    if sparse:
+        if scipy is None:
+            raise ImportError("Sparse exposures require scipy")
+
+        edges = np.array(g.get_edgelist(), dtype=int).reshape(-1, 2)
+        M = scipy.sparse.csc_matrix((np.ones(Z), (edges[:, 0], edges[:, 1])), shape=(N, N))
+        M.sum_duplicates()
+
+        lent = np.bincount(edges[:, 0], minlength=N)
+        borrowed = np.bincount(edges[:, 1], minlength=N)
+    else:
+        M = np.array(g.get_adjacency().data)
+
+        lent = np.sum(M, 1)
+        borrowed = np.sum(M.transpose(), 1)
+
+    return M, lent, borrowed, Z
+
+
+def capital(topo, E, gamma, theta):
+    """ Generating weights for a topology, see apply
+
+    Parameters
+    ----------
+    topo : tuple
+        Output of topology method.
     E : float
         Total external assets of network.
     gamma : float
@@ -30,30 +113,22 @@ def apply(g, E, gamma, theta):
 
     Returns
     -------
-    6xN array [a, e, i, c, d, b]
-        a - individual bank's assets
-        e - external assets
-        i - interbank assets
-        c - net worths
-        d - customers' deposits
-        b - interbank borrowing
+    tuple
+        Same as apply.
 
     """
-
-    N = g.vcount()
+    M, lent, borrowed, Z = topo
+    N = lent.size
     beta = 1 - theta
     A = E / beta;
     I = theta * A
-    Z = g.ecount()
 
     w = I / Z if Z > 0 else 0
 
-    M = np.array(g.get_adjacency().data)
-
     i_full = M * w
 
-    i = w * np.sum(M, 1)
-    b = w * np.sum(M.transpose(), 1)
+    i = w * lent
+    b = w * borrowed
 
     # e_tilde = np.maximum(b - i, np.zeros(i.size))
     e_tilde = b - i
@@ -68,6 +143,39 @@ def apply(g, E, gamma, theta):
     return a, e, i, c, d, b, i_full, w
 
 
+def apply(g, E, gamma, theta, sparse = False):
+    """ Generating weights for given topology
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Given graph.
+    E : float
+        Total external assets of network.
+    gamma : float
+        Net worth as percenage of total assets.
+    theta : float
+        Interbank assets as percenage of total assets.
+    sparse : Boolean
+        Whether to build i_full as scipy.sparse.csc_matrix from the edge
+        list, so that memory scales with edges instead of N^2.
+
+    Returns
+    -------
+    6xN array [a, e, i, c, d, b]
+        a - individual bank's assets
+        e - external assets
+        i - interbank assets
+        c - net worths
+        d - customers' deposits
+        b - interbank borrowing
+    i_full - NxN matrix of interbank exposures
+    w - weight of single interbank link
+
+    """
+    return capital(topology(g, sparse), E, gamma, theta)
+
+
 def simulate(g, weights, shock_size, shock_bank):
     """SImulation of default dynamics
 
@@ -89,6 +197,13 @@ def simulate(g, weights, shock_size, shock_bank):
 
     """
     [a, e, i, c, d, b, i_full, _] = weights
+    if is_sparse(i_full):
+        # sparse exposures are never copied as a whole
+        return simulate_frontier(g, weights, shock_size, shock_bank)
+
+    if kernels.enabled():
+        return kernels.cascade(a, c, b, i_full, shock_size, shock_bank)
+
     i_full = np.copy(i_full)
     b = np.copy(b)
     c = np.copy(c)
@@ -127,7 +242,181 @@ def simulate(g, weights, shock_size, shock_bank):
     return sum([1 if x < eps else 0 for x in c])
 
 
-def sim_defaults(E, N, p, theta, gamma, shock):
+def simulate_frontier(g, weights, shock_size, shock_bank):
+    """Event-driven simulation of default dynamics
+
+    Gives the same number of defaults as simulate, but instead of sweeping
+    over all banks on every pass only the banks with pending shock are
+    visited, in the same order simulate would visit them. Only the columns
+    of i_full that belong to defaulting banks are read.
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Directed graph to use for simulation.
+    weights : tuple
+        Output of apply method.
+    shock_size : float
+        Initial shock size.
+    shock_bank : int
+        Bank where initial shock is applied.
+
+    Returns
+    -------
+    int
+        Number of defaults.
+
+    """
+    [a, e, i, c, d, b, i_full, _] = weights
+    b = np.copy(b)
+    c = np.copy(c)
+    N = g.vcount()
+
+    shock = np.zeros(N)
+    shock[shock_bank] = min(shock_size, a[shock_bank])
+
+    eps = 1
+    solvent = np.count_nonzero(c > eps)
+
+    # columns of i_full modified during this cascade
+    columns = {}
+
+    # banks waiting for a visit, keyed by (sweep, bank) so that they
+    # are visited in the same order as in simulate
+    frontier = [(0, shock_bank)]
+    queued = {shock_bank}
+    sweep = -1
+
+    while frontier:
+        if frontier[0][0] != sweep:
+            # new sweep, same stopping conditions as in simulate
+            if solvent == 0 or max(shock[j] for _, j in frontier) <= eps:
+                break
+            sweep = frontier[0][0]
+
+        _, s_i = heapq.heappop(frontier)
+        queued.remove(s_i)
+
+        s_shock = shock[s_i]
+        if s_shock > eps:
+            not_absorbed = max(0, s_shock - c[s_i])
+            was_solvent = c[s_i] > eps
+            c[s_i] = max(0, c[s_i] - s_shock)
+            if was_solvent and c[s_i] <= eps:
+                solvent -= 1
+            shock[s_i] = 0
+
+            # calculate only interbank
+            not_absorbed = min(not_absorbed, b[s_i])
+            if not_absorbed > 0:
+                b[s_i] -= not_absorbed
+
+                if s_i in columns:
+                    creditors, borrowers = columns[s_i]
+                else:
+                    creditors, borrowers = exposures(g, i_full, s_i)
+                borrowed = sum(borrowers)
+                loss = borrowers * not_absorbed / borrowed
+                columns[s_i] = (creditors, borrowers - loss)
+                shock[creditors] += loss
+
+                for j in creditors:
+                    if j != s_i and j not in queued:
+                        queued.add(j)
+                        heapq.heappush(frontier, (sweep if j > s_i else sweep + 1, j))
+
+        shock[s_i] = 0
+
+    return np.count_nonzero(c < eps)
+
+
+def simulate_all(g, weights, shock_size, origins=None, net_worth=None, columns=None):
+    """Simulation of default dynamics for many shock origins at once
+
+    Cascades from all origins are run together on state matrices
+    (origin x bank). Banks are swept in the same order as in simulate,
+    so the results match simulate up to floating point rounding.
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Directed graph to use for simulation.
+    weights : tuple
+        Output of apply method.
+    shock_size : float or array
+        Initial shock size, either common or one for each origin.
+    origins : array
+        Banks where initial shocks are applied, every bank by default.
+    net_worth : array
+        Net worths of banks for each origin (origin x bank), so that
+        cascades with different gamma run together. c of weights by default.
+    columns : array
+        Creditors and exposures of every bank, see exposures. Computed from
+        g and i_full by default, pass to reuse between calls on the same graph.
+
+    Returns
+    -------
+    array
+        Number of defaults for each origin.
+
+    """
+    [a, e, i, c, d, b, i_full, _] = weights
+    N = g.vcount()
+
+    if origins is None:
+        origins = np.arange(N)
+    origins = np.asarray(origins, dtype=int)
+    K = origins.size
+
+    # state matrices are column-major, as a sweep reads them bank by bank
+    if net_worth is None:
+        c = np.asfortranarray(np.tile(c, (K, 1)))
+    else:
+        c = np.array(net_worth, dtype=float, order='F').reshape(K, N)
+    b = np.asfortranarray(np.tile(b, (K, 1)))
+    shock = np.zeros((K, N), order='F')
+    shock[np.arange(K), origins] = np.minimum(shock_size, a[origins])
+
+    # losses of creditors are proportional to the initial column of i_full
+    if columns is None:
+        columns = [exposures(g, i_full, s_i) for s_i in range(N)]
+    borrowed = np.asarray(i_full.sum(0)).ravel()
+
+    eps = 1
+    if kernels.enabled():
+        return kernels.cascade_rows(c, b, shock, columns, borrowed, eps)
+
+    active = np.ones(K, dtype=bool)
+    while True:
+        active &= (np.max(shock, 1) > eps) & (np.max(c, 1) > eps)
+        if not active.any():
+            break
+
+        for s_i in range(N):
+            hit = np.flatnonzero(active & (shock[:, s_i] > eps))
+            if hit.size > 0:
+                s_shock = shock[hit, s_i]
+                not_absorbed = np.maximum(0, s_shock - c[hit, s_i])
+                c[hit, s_i] = np.maximum(0, c[hit, s_i] - s_shock)
+
+                # calculate only interbank
+                not_absorbed = np.minimum(not_absorbed, b[hit, s_i])
+                spread = not_absorbed > 0
+                if spread.any():
+                    hit = hit[spread]
+                    not_absorbed = not_absorbed[spread]
+                    b[hit, s_i] -= not_absorbed
+
+                    creditors, borrowers = columns[s_i]
+                    loss = np.outer(not_absorbed / borrowed[s_i], borrowers)
+                    shock[np.ix_(hit, creditors)] += loss
+
+            shock[active, s_i] = 0
+
+    return np.sum(c < eps, 1)
+
+
+def sim_defaults(E, N, p, theta, gamma, shock, sparse = False, seed = None):
     """Launch simulation for random G(n, p) graph
         from every node in graph
 
@@ -145,6 +434,11 @@ def sim_defaults(E, N, p, theta, gamma, shock):
         Interbank assets as percenage of total assets.
     shock : float
         Size of initial shock.
+    sparse : Boolean
+        Whether to use sparse exposures, for networks too large for
+        dense NxN matrices. Origins are then simulated one by one.
+    seed : int or array
+        Seed of the random graph, fresh entropy by default.
 
     Returns
     -------
@@ -152,13 +446,70 @@ def sim_defaults(E, N, p, theta, gamma, shock):
         Average number of defaults.
 
     """
-    G = random_graph.Directed2(N, p)
-    weights = apply(G, E, gamma, theta)
-    defaults = []
-    for bank in range(G.vcount()):
-        defaults.append(simulate(G, weights, shock, bank))
+    G = random_graph.Directed2(N, p, seed)
+    weights = apply(G, E, gamma, theta, sparse)
+    if sparse:
+        defaults = [simulate_frontier(G, weights, shock, bank) for bank in range(N)]
+    else:
+        defaults = simulate_all(G, weights, shock)
+
+    return np.sum(defaults) / G.vcount()
+
 
-    return sum(defaults) / G.vcount()
+def sim_defaults_ensemble(variables, seed = None):
+    """Launch simulations with different parameters on one random G(n, p) graph
+
+    Topology dependent parts of weights are computed once. Variations
+    that differ only in gamma are simulated together, with net worth
+    of each variation as separate rows of simulate_all.
+
+    Parameters
+    ----------
+    variables : array
+        Array of tuples of arguments of sim_defaults,
+        all with the same N, p and sparse.
+    seed : int or array
+        Seed of the random graph, fresh entropy by default.
+
+    Returns
+    -------
+    array
+        Average number of defaults of each variation.
+
+    """
+    E, N, p = variables[0][:3]
+    sparse = variables[0][6] if len(variables[0]) > 6 else False
+    G = random_graph.Directed2(N, p, seed)
+    topo = topology(G, sparse)
+
+    groups = {}
+    for index, params in enumerate(variables):
+        E, _, _, theta, gamma, shock = params[:6]
+        groups.setdefault((E, theta, shock), []).append((index, gamma))
+
+    results = [None] * len(variables)
+    for (E, theta, shock), members in groups.items():
+        if sparse:
+            for index, gamma in members:
+                weights = capital(topo, E, gamma, theta)
+                defaults = [simulate_frontier(G, weights, shock, bank) for bank in range(N)]
+                results[index] = np.sum(defaults) / N
+            continue
+
+        weights = capital(topo, E, 0, theta)
+        a = weights[0]
+        # bound size of state matrices, origin x bank for every gamma
+        step = max(1, 2 ** 22 // max(N * N, 1))
+        for start in range(0, len(members), step):
+            part = members[start:start + step]
+            gammas = np.array([gamma for _, gamma in part])
+            net_worth = np.repeat(np.outer(gammas, a), N, axis=0)
+            origins = np.tile(np.arange(N), len(part))
+            defaults = simulate_all(G, weights, shock, origins, net_worth).reshape(len(part), N)
+            for (index, _), d in zip(part, defaults):
+                results[index] = np.sum(d) / N
+
+    return results
 
 
 def plot_results(x, x_label, N, results):
@@ -202,16 +553,103 @@ def plot_results_multiple(x, x_label, N, results, labels):
     plt.show(block=False)
 
 
-def Multicore_variation(variables, each_iter):
+# worker pool shared by calls of Multicore_variation, see Worker_pool
+pool = None
+
+
+def Worker_pool():
+    """Returns pool of worker processes, started on first use
+
+    Workers stay alive between calls, so consecutive variations
+    do not pay for process startup and imports again.
+
+    Returns
+    -------
+    multiprocessing.Pool
+        Shared pool.
+
+    """
+    global pool
+    if pool is None:
+        pool = multiprocessing.Pool()
+        atexit.register(Close_pool)
+    return pool
+
+
+def Close_pool():
+    """Stops shared pool of worker processes"""
+    global pool
+    if pool is not None:
+        pool.close()
+        pool.join()
+        pool = None
+
+
+def Sim_chunk(task):
+    """Runs several replicates of sim_defaults
+
+    Parameters
+    ----------
+    task : tuple
+        0 - index of variation
+        1 - arguments of sim_defaults
+        2 - array of (replicate, seed) tuples
+
+    Returns
+    -------
+    array
+        Array of (index of variation, replicate, result) tuples.
+
+    """
+    i, params, replicates = task
+    return [(i, r, sim_defaults(*params, seed = seed)) for r, seed in replicates]
+
+
+def Sim_ensemble(task):
+    """Runs one replicate of several variations on a common graph
+
+    Parameters
+    ----------
+    task : tuple
+        0 - array of indices of variations
+        1 - array of arguments of sim_defaults, see sim_defaults_ensemble
+        2 - replicate
+        3 - seed
+
+    Returns
+    -------
+    array
+        Array of (index of variation, replicate, result) tuples.
+
+    """
+    indices, variables, r, seed = task
+    return [(i, r, result) for i, result in zip(indices, sim_defaults_ensemble(variables, seed))]
+
+
+def Multicore_variation(variables, each_iter, cache = None, seed = None, common = False, cluster = None):
     """Do defaults simulation with different
         parameters on multiple cores
 
+    Replicates of a variation are sent to workers in chunks,
+    about four chunks per worker in total.
+
     Parameters
     ----------
     variables : array
         Array of tuples of arguments that would be passed to sim_defaults.
     each_iter : type
         Number of iterations per each variation.
+    cache : result_cache.ResultCache
+        Store of results, replicates found there are not simulated again.
+    seed : int
+        Seed of the sweep, replicate r uses graph seed [seed, r].
+        Fresh entropy by default.
+    common : Boolean
+        Use common random numbers: replicate r of all variations with
+        the same N and p is simulated on the same graph, whose topology
+        is processed once, see sim_defaults_ensemble.
+    cluster : distributed.Cluster
+        Run tasks on workers of a work queue server instead of local cores.
 
     Returns
     -------
@@ -219,28 +657,50 @@ def Multicore_variation(variables, each_iter):
         Array of arrays of each variable type and simulation.
 
     """
-    sets = []
-    set_to_result = []
-    results = [[] for _ in variables]
-    for i, params in enumerate(variables):
-        for _ in range(each_iter):
-            sets.append(params)
-            set_to_result.append(i)
-
-    pool = multiprocessing.Pool()
-    rs = pool.starmap_async(sim_defaults, sets)
-    pool.close()
-
-    while (True):
-        if (rs.ready()): break
-        remaining = rs._number_left
-        print("Waiting for %i tasks to complete..." % (remaining), end="\r")
-        time.sleep(0.25)
-
-    print("\r\nDone")
-
-    raw_results = rs.get()
-    for i, r in enumerate(raw_results):
-        results[set_to_result[i]].append(r)
+    results = [[None] * each_iter for _ in variables]
+    missing = [[r for r in range(each_iter)] for _ in variables]
+    if cache is not None:
+        keys = [[make_key("sim_defaults", list(params), seed, r) for r in range(each_iter)] for params in variables]
+        found = cache.get_many([k for row in keys for k in row])
+        for i in range(len(variables)):
+            missing[i] = []
+            for r in range(each_iter):
+                if keys[i][r] in found:
+                    results[i][r] = found[keys[i][r]]
+                else:
+                    missing[i].append(r)
+
+    remaining = sum([len(m) for m in missing])
+    workers = multiprocessing.cpu_count() if cluster is None else max(cluster.broker.workers(), 1)
+
+    tasks = []
+    if common:
+        # variations sharing graph parameters, replicate by replicate
+        ensembles = {}
+        for i, params in enumerate(variables):
+            key = (params[1], params[2], params[6] if len(params) > 6 else False)
+            for r in missing[i]:
+                ensembles.setdefault((key, r), []).append(i)
+        for (_, r), indices in ensembles.items():
+            tasks.append((indices, [variables[i] for i in indices], r, None if seed is None else [seed, r]))
+        fn = Sim_ensemble
+    else:
+        chunk = max(1, min(each_iter, remaining // (workers * 4)))
+        for i, params in enumerate(variables):
+            replicates = [(r, None if seed is None else [seed, r]) for r in missing[i]]
+            for start in range(0, len(replicates), chunk):
+                tasks.append((i, params, replicates[start:start + chunk]))
+        fn = Sim_chunk
+
+    if len(tasks) > 0:
+        if cluster is not None:
+            completed = cluster.imap(fn, tasks, "replicates", size = len, total = remaining)
+        else:
+            completed = imap_progress(Worker_pool(), fn, tasks, "replicates", size = len, total = remaining, workers = workers)
+        for replicates in completed:
+            for i, r, result in replicates:
+                results[i][r] = result
+            if cache is not None:
+                cache.put_many([(keys[i][r], result) for i, r, result in replicates])
 
     return results
@@ -0,0 +1,427 @@
+"""
+    Stress-test service keeping graphs and their weights in memory
+
+    Graphs are loaded once, with their topology and exposures of every
+    bank. Scenario queries "defaults if bank k takes shock X under gamma g"
+    are answered over HTTP. Concurrent queries against the same graph are
+    coalesced into a single batched cascade, see simulation.simulate_all.
+
+        python stress_service.py --graph g1=pregenerated_graphs/communities/communities_1/0.graph
+        python stress_service.py --random er=25,0.2 --port 8642
+
+        curl -d '{"graph": "er", "bank": 3, "shock": 100000, "gamma": 0.05}' localhost:8642/query
+        curl -d '[{"graph": "er", "bank": 3, "shock": 50000, "gamma": 0.03}, ...]' localhost:8642/query
+        curl localhost:8642/graphs
+
+    Every scenario returns number of defaults, same as simulation.simulate.
+"""
+import argparse
+import json
+import numbers
+import os
+import queue
+import random
+import socketserver
+import threading
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from igraph import Graph
+
+import random_graph
+import simulation
+from generate_graph import Make_directed
+from graph_library import GraphLibrary
+
+# larger graphs keep exposures as scipy.sparse, see simulation.topology
+SPARSE_N = 1000
+
+
+def integer(value, name):
+    """Value of a JSON field that must be an integer, raises ValueError"""
+    if isinstance(value, bool) or not isinstance(value, numbers.Real) or not float(value).is_integer():
+        raise ValueError("%s must be an integer, got %s" % (name, json.dumps(value, default=str)))
+    return int(value)
+
+
+class ResidentGraph():
+    """Graph with everything of a cascade that does not depend on a scenario
+
+    Weights are computed for gamma 1, net worths of a scenario are gamma
+    times assets, as in capital. Graphs with more than SPARSE_N banks
+    keep exposures as scipy.sparse when it is installed.
+
+    Parameters
+    ----------
+    g : igraph.Graph
+        Directed graph.
+    E : float
+        Total external assets of network.
+    theta : float
+        Interbank assets as percenage of total assets.
+
+    """
+    def __init__(self, g, E = 100000, theta = 0.2):
+        self.g = g
+        self.E = E
+        self.theta = theta
+        sparse = g.vcount() > SPARSE_N and simulation.scipy is not None
+        self.weights = simulation.capital(simulation.topology(g, sparse), E, 1, theta)
+        i_full = self.weights[6]
+        self.columns = [simulation.exposures(g, i_full, s_i) for s_i in range(g.vcount())]
+
+    def check(self, bank, shock, gamma):
+        """Validated scenario, raises ValueError"""
+        bank = integer(bank, "Bank")
+        shock = float(shock)
+        gamma = float(gamma)
+        if not 0 <= bank < self.g.vcount():
+            raise ValueError("Bank %i out of range 0-%i" % (bank, self.g.vcount() - 1))
+        if shock < 0:
+            raise ValueError("Shock must not be negative")
+        if not 0 <= gamma <= 1:
+            raise ValueError("Gamma must be between 0 and 1")
+        return bank, shock, gamma
+
+    def evaluate(self, scenarios):
+        """Number of defaults of every scenario
+
+        Parameters
+        ----------
+        scenarios : array
+            Array of (bank, shock, gamma) tuples.
+
+        Returns
+        -------
+        array
+            Number of defaults for each scenario.
+
+        """
+        banks, shocks, gammas = [np.array(x) for x in zip(*scenarios)]
+        a = self.weights[0]
+        return simulation.simulate_all(self.g, self.weights, shocks.astype(float), banks.astype(int),
+                                       np.outer(gammas, a), self.columns)
+
+    def info(self):
+        return {'N': self.g.vcount(), 'edges': self.g.ecount(), 'E': self.E, 'theta': self.theta}
+
+
+class Pending():
+    """Scenarios of a request waiting for their batch"""
+    def __init__(self, scenarios):
+        self.scenarios = scenarios
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Batcher():
+    """Evaluates queued scenarios of a graph in batches on its own thread
+
+    Everything queued while a batch runs goes into the next batch.
+
+    Parameters
+    ----------
+    graph : ResidentGraph
+        Graph of the scenarios.
+    max_batch : int
+        Largest number of scenarios in a batch.
+    window : float
+        Seconds to wait for more requests before a batch starts.
+
+    """
+    def __init__(self, graph, max_batch = 4096, window = 0):
+        self.graph = graph
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.scenarios = 0
+        self.seconds = 0
+        threading.Thread(target = self.run, daemon = True).start()
+
+    def submit(self, scenarios):
+        """Number of defaults of every scenario, blocks until its batch is done"""
+        pending = Pending(scenarios)
+        self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            if self.window > 0:
+                time.sleep(self.window)
+            count = len(batch[0].scenarios)
+            while count < self.max_batch:
+                try:
+                    pending = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                count += len(pending.scenarios)
+
+            start = time.perf_counter()
+            try:
+                defaults = self.graph.evaluate([s for pending in batch for s in pending.scenarios])
+                offset = 0
+                for pending in batch:
+                    pending.result = [int(x) for x in defaults[offset:offset + len(pending.scenarios)]]
+                    offset += len(pending.scenarios)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+
+            self.seconds += time.perf_counter() - start
+            self.batches += 1
+            self.scenarios += count
+            for pending in batch:
+                pending.done.set()
+
+    def info(self):
+        return {'batches': self.batches, 'scenarios': self.scenarios, 'seconds': self.seconds}
+
+
+class StressService():
+    """Resident graphs and their batchers
+
+    Parameters
+    ----------
+    max_batch : int
+        Largest number of scenarios in a batch.
+    window : float
+        Seconds to wait for more requests before a batch starts.
+
+    """
+    def __init__(self, max_batch = 4096, window = 0):
+        self.max_batch = max_batch
+        self.window = window
+        self.graphs = {}
+        self.lock = threading.Lock()
+
+    def load(self, name, g, E = 100000, theta = 0.2, seed = None):
+        """Makes graph resident under name, undirected graphs are directed with Make_directed"""
+        if not g.is_directed():
+            g = Make_directed(g, random.Random(seed))
+        graph = ResidentGraph(g, E, theta)
+        with self.lock:
+            self.graphs[name] = (graph, Batcher(graph, self.max_batch, self.window))
+
+    def query(self, queries):
+        """Number of defaults of every query
+
+        Parameters
+        ----------
+        queries : array
+            Array of dicts with keys graph, bank, shock and gamma.
+
+        Returns
+        -------
+        array
+            Number of defaults for each query, in the same order.
+
+        """
+        groups = {}
+        for k, q in enumerate(queries):
+            if q.get('graph') not in self.graphs:
+                raise ValueError('Unknown graph "%s"' % q.get('graph'))
+            if q['graph'] not in groups:
+                groups[q['graph']] = (self.graphs[q['graph']], [])
+            (graph, _), group = groups[q['graph']]
+            group.append((k, graph.check(q['bank'], q['shock'], q['gamma'])))
+
+        defaults = [None] * len(queries)
+        for (_, batcher), group in groups.values():
+            for (k, _), result in zip(group, batcher.submit([s for _, s in group])):
+                defaults[k] = result
+        return defaults
+
+    def info(self):
+        return {name: dict(graph.info(), **batcher.info()) for name, (graph, batcher) in self.graphs.items()}
+
+
+def read_graph(path):
+    """Graph from a pickled graph file or "library.glib#index" """
+    if "#" in path:
+        path, index = path.rsplit("#", 1)
+        return GraphLibrary(path).graph(int(index))
+    return Graph.Read_Pickle(path)
+
+
+def library_path(load_dir, path):
+    """Path of "library.glib#index" inside load_dir, requested over HTTP
+
+    Only graph libraries are read, they are not unpickled.
+
+    Raises
+    ------
+    PermissionError
+        If path is outside load_dir.
+    ValueError
+        If path is not a graph library.
+
+    """
+    library, _, index = path.rpartition("#")
+    if not library.endswith(".glib") or not index:
+        raise ValueError('Only graph libraries can be loaded, "library.glib#index"')
+    root = os.path.realpath(load_dir)
+    full = os.path.realpath(os.path.join(root, library))
+    if os.path.commonpath([root, full]) != root:
+        raise PermissionError("Path is outside of --load-dir")
+    return "%s#%s" % (full, index)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """JSON endpoints of a StressService
+
+    GET /graphs - resident graphs and their batch counters
+    POST /query - scenario dict or array of them, returns defaults
+    POST /load - {"name", "path"} or {"name", "N", "p"}, optional E, theta, seed,
+                 path is "library.glib#index" relative to load_dir, only
+                 enabled with load_dir and for graphs of at most max_n banks
+
+    """
+    service = None
+    verbose = False
+    load_dir = None
+    max_n = 2500
+
+    def reply(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/graphs":
+            self.reply(200, self.service.info())
+        else:
+            self.reply(404, {'error': "Unknown path %s" % self.path})
+
+    def do_POST(self):
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            if self.path == "/query":
+                if isinstance(data, list):
+                    self.reply(200, {'defaults': self.service.query(data)})
+                else:
+                    self.reply(200, {'defaults': self.service.query([data])[0]})
+            elif self.path == "/load":
+                if self.load_dir is None:
+                    raise PermissionError("Loading graphs is disabled, start the service with --load-dir")
+                if 'path' in data:
+                    g = read_graph(library_path(self.load_dir, data['path']))
+                    N = g.vcount()
+                else:
+                    N = integer(data['N'], "N")
+                    p = float(data['p'])
+                    if not 0 <= p <= 1:
+                        raise ValueError("p must be between 0 and 1")
+                if not 1 <= N <= self.max_n:
+                    raise ValueError("Graphs must have 1-%i banks, see --max-n" % self.max_n)
+                if 'path' not in data:
+                    g = random_graph.Directed2(N, p, data.get('seed'))
+                self.service.load(data['name'], g, data.get('E', 100000), data.get('theta', 0.2), data.get('seed'))
+                self.reply(200, self.service.info()[data['name']])
+            else:
+                self.reply(404, {'error': "Unknown path %s" % self.path})
+        except PermissionError as e:
+            self.reply(403, {'error': str(e)})
+        except KeyError as e:
+            self.reply(400, {'error': "Missing key %s" % e})
+        except (ValueError, TypeError, AttributeError, OSError) as e:
+            self.reply(400, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # concurrent queries wait in the backlog instead of being reset
+    request_queue_size = 128
+
+
+def serve(service, address = ("127.0.0.1", 8642), verbose = False, load_dir = None, max_n = 2500):
+    """Answers queries to service until interrupted
+
+    Parameters
+    ----------
+    service : StressService
+        Service with resident graphs.
+    address : tuple
+        (host, port) to listen on.
+    verbose : Boolean
+        Log every request.
+    load_dir : string
+        Directory of graph libraries that clients may load, /load is
+        disabled by default.
+    max_n : int
+        Largest number of banks of a graph loaded with /load.
+
+    """
+    handler = type("BoundHandler", (Handler,), {'service': service, 'verbose': verbose,
+                                                'load_dir': load_dir, 'max_n': max_n})
+    server = Server(address, handler)
+    print("Serving %i graphs on http://%s:%i" % ((len(service.graphs),) + server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Warm stress-test service answering default scenarios of resident graphs')
+
+    parser.add_argument('--graph', dest='graphs', nargs='+', default=[],
+                        help='name=path of pickled graph or name=library.glib#index')
+
+    parser.add_argument('--random', dest='random', nargs='+', default=[],
+                        help='name=N,p of a directed Erdös-Rényi graph')
+
+    parser.add_argument('--E', dest='E', type=float, default=100000,
+                        help='Total external assets of every graph')
+
+    parser.add_argument('--theta', dest='theta', type=float, default=0.2,
+                        help='Interbank assets as percentage of total assets')
+
+    parser.add_argument('--seed', dest='seed', type=int, default=None,
+                        help='Seed of random graphs and of edge directions of undirected graphs')
+
+    parser.add_argument('--host', dest='host', default='127.0.0.1')
+
+    parser.add_argument('--port', dest='port', type=int, default=8642)
+
+    parser.add_argument('--max-batch', dest='maxBatch', type=int, default=4096,
+                        help='Largest number of scenarios evaluated together')
+
+    parser.add_argument('--window', dest='window', type=float, default=0,
+                        help='Seconds to wait for more requests before a batch starts')
+
+    parser.add_argument('--verbose', dest='verbose', action='store_true',
+                        help='Log every request')
+
+    parser.add_argument('--load-dir', dest='loadDir', default=None,
+                        help='Enables /load, of graph libraries in this directory and of random graphs')
+
+    parser.add_argument('--max-n', dest='maxN', type=int, default=2500,
+                        help='Largest number of banks of a graph loaded with /load')
+
+    args = parser.parse_args()
+
+    service = StressService(args.maxBatch, args.window)
+    for spec in args.graphs:
+        name, path = spec.split("=", 1)
+        service.load(name, read_graph(path), args.E, args.theta, args.seed)
+    for spec in args.random:
+        name, params = spec.split("=", 1)
+        N, p = params.split(",")
+        service.load(name, random_graph.Directed2(int(N), float(p), args.seed), args.E, args.theta, args.seed)
+
+    serve(service, (args.host, args.port), args.verbose, args.loadDir, args.maxN)
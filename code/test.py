@@ -7,6 +7,8 @@ import time
 import matplotlib.pyplot as plt
 
 from simulation import Multicore_variation, plot_results, plot_results_multiple
+from result_cache import ResultCache
+from distributed import Cluster
 
 DEFAULT_PARAMS = {
     'E': 100000,
@@ -17,6 +19,12 @@ DEFAULT_PARAMS = {
     'shock': 100000,
 }
 
+# result cache, seed and cluster, set from command line
+SIM_OPTIONS = {}
+
+# sweep mode of Multicore_variation, set from command line
+VARIATION_OPTIONS = {}
+
 
 def gamma_variation():
     print("Variating net worth")
@@ -29,7 +37,7 @@ def gamma_variation():
                   gamma, DEFAULT_PARAMS['shock'])
         variables.append(params)
 
-    results = Multicore_variation(variables, 100)
+    results = Multicore_variation(variables, 100, **SIM_OPTIONS, **VARIATION_OPTIONS)
 
     plot_results(gammas, "Percentage net worth", DEFAULT_PARAMS['N'], results)
 
@@ -45,7 +53,7 @@ def theta_variation():
                   DEFAULT_PARAMS['gamma'], DEFAULT_PARAMS['shock'])
         variables.append(params)
 
-    results = Multicore_variation(variables, 100)
+    results = Multicore_variation(variables, 100, **SIM_OPTIONS, **VARIATION_OPTIONS)
 
     plot_results(thetas, "Percentage interbank assets", DEFAULT_PARAMS['N'], results)
 
@@ -54,18 +62,19 @@ def p_variation():
     print("Variating density")
     probs = np.linspace(0.01, 0.99, num=100)
 
-    results = []
-    labels = []
-    for gamma in [0.01, 0.03, 0.07]:
-        print("Gamma %.2f" % gamma)
-        variables = []
+    gammas = [0.01, 0.03, 0.07]
+    labels = ["Net worth %.0f%%" % (gamma * 100) for gamma in gammas]
+
+    # all net worths in one sweep, so that common ensembles are shared
+    variables = []
+    for gamma in gammas:
         for p in probs:
             params = (DEFAULT_PARAMS['E'], DEFAULT_PARAMS['N'],
                       p, DEFAULT_PARAMS['theta'],
                       gamma, DEFAULT_PARAMS['shock'])
             variables.append(params)
-        results.append(Multicore_variation(variables, 100))
-        labels.append("Net worth %.0f%%" % (gamma * 100))
+    sweep = Multicore_variation(variables, 100, **SIM_OPTIONS, **VARIATION_OPTIONS)
+    results = [sweep[k * len(probs):(k + 1) * len(probs)] for k in range(len(gammas))]
 
     plot_results_multiple(probs, "Erdös-Rényi probability", DEFAULT_PARAMS['N'], results, labels)
 
@@ -86,7 +95,27 @@ if __name__ == "__main__":
                         action='store_true',
                         help='Reproduce crisis simulation methods described in paper "Network models and financial stability"')
 
+    parser.add_argument('--cache', dest='cache', default=None,
+                        help='SQLite file that stores results, only missing points are simulated')
+
+    parser.add_argument('--seed', dest='seed', type=int, default=None,
+                        help='Seed of random graphs, results are reproducible and cached by seed')
+
+    parser.add_argument('--common-ensemble', dest='common',
+                        action='store_true',
+                        help='Simulate all points of a sweep on the same random graphs')
+
+    parser.add_argument('--cluster', dest='cluster', default=None,
+                        help='Run simulations on workers of a work queue server at host:port, see distributed.py')
+
     args = parser.parse_args()
 
+    if args.cache:
+        SIM_OPTIONS['cache'] = ResultCache(args.cache)
+    SIM_OPTIONS['seed'] = args.seed
+    if args.cluster:
+        SIM_OPTIONS['cluster'] = Cluster(args.cluster)
+    VARIATION_OPTIONS['common'] = args.common
+
     if args.reproduceSim:
         reproduceSim()